@@ -0,0 +1,40 @@
+#!/usr/bin/python
+# Parse-throughput benchmark: the hand-written parser against the original pyparsing grammar.
+# Usage: python bench_parser.py [rounds]
+import sys
+import time
+import sqlengine
+
+QUERIES = [
+    "select * from table1",
+    "select max(A) from table1",
+    "select A,D from table1,table2",
+    "select distinct(C) from table3",
+    "select B,C from table1 where A=-900",
+    "select A,B from table1 where A=775 OR B=803",
+    "select distinct A, B from table1 where A >= 10 and B ne 3;",
+    "select * from table1,table2 where table1.B=table2.B",
+    "select table1.A, count(*) from table1,table2 where table1.B=table2.B and D<6000",
+]
+
+def measure(parser, rounds):
+    queries = [query.lower() for query in QUERIES]
+    start = time.time()
+    for i in xrange(rounds):
+        for query in queries:
+            parser(query)
+    return (time.time() - start) / (rounds * len(queries))
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    sqlengine.loadParser(True)
+    pyparsingTime = measure(sqlengine.sqlParser, rounds)
+    sqlengine.loadParser(False)
+    handTime = measure(sqlengine.sqlParser, rounds)
+
+    print "pyparsing grammar : %8.1f us/query  %9.0f queries/s" % (pyparsingTime * 1e6, 1 / pyparsingTime)
+    print "hand-written      : %8.1f us/query  %9.0f queries/s" % (handTime * 1e6, 1 / handTime)
+    print "speedup           : %8.1fx" % (pyparsingTime / handTime)
+
+if __name__ == "__main__":
+    main()
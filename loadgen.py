@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# Load generator for the streaming query server: every client runs the queries of a script in turn
+# on its own connection and the latencies of all of them are summed up.
+# Usage: python loadgen.py HOST:PORT|/path/to/socket [clients] [rounds] [script.sql]
+import sys
+import threading
+import time
+import sqlclient
+import sqlengine
+
+QUERIES = [
+    "select * from table1 limit 100",
+    "select count(*) from table1",
+    "select max(A), min(B) from table1",
+    "select A, B from table1 where A > 100 and B < 500 limit 1000",
+    "select A, count(*) from table1 group by A order by A limit 10",
+    "select * from table1, table2 where table1.B = table2.B limit 1000",
+]
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def runClient(address, queries, rounds, latencies, firstRows, errors):
+    client = sqlclient.SqlClient(address)
+    for i in xrange(rounds):
+        for query in queries:
+            start = time.time()
+            first = None
+            try:
+                for row in client.query(query):
+                    if first is None:
+                        first = time.time() - start
+            except sqlclient.QueryError:
+                errors.append(query)
+                continue
+            latencies.append(time.time() - start)
+            if first is not None:
+                firstRows.append(first)
+    client.close()
+
+def main():
+    if len(sys.argv) < 2:
+        print "Usage: python loadgen.py HOST:PORT|/path/to/socket [clients] [rounds] [script.sql]"
+        sys.exit(2)
+    address = sys.argv[1]
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    queries = QUERIES
+    if len(sys.argv) > 4:
+        with open(sys.argv[4]) as script:
+            queries = sqlengine.splitStatements(script.read())
+
+    latencies, firstRows, errors = [], [], []
+    threads = [threading.Thread(target=runClient, args=(address, queries, rounds, latencies, firstRows, errors))
+               for i in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    firstRows.sort()
+    print "clients           : %d x %d queries" % (clients, rounds * len(queries))
+    print "throughput        : %9.1f queries/s" % (len(latencies) / elapsed)
+    if latencies:
+        print "latency           : p50 %8.1f ms  p95 %8.1f ms  p99 %8.1f ms" % tuple(
+            percentile(latencies, fraction) * 1000 for fraction in (0.5, 0.95, 0.99))
+    if firstRows:
+        print "time to first row : p50 %8.1f ms  p95 %8.1f ms  p99 %8.1f ms" % tuple(
+            percentile(firstRows, fraction) * 1000 for fraction in (0.5, 0.95, 0.99))
+    print "errors            : %d" % len(errors)
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# Client for the streaming query server (python sqlengine.py --serve ADDRESS --stream).
+# Usage: python sqlclient.py HOST:PORT|/path/to/socket "query" ...
+# Rows are printed as they arrive; Ctrl-C cancels the running query.
+import signal
+import socket
+import sys
+
+class QueryError(Exception):
+    pass
+
+class QueryCancelled(Exception):
+    pass
+
+def parseValue(value):
+    if value == "NULL":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+class Result(object):
+    # the reply to one query, read from the connection while it is iterated: yields the rows as
+    # tuples, then raises QueryError or QueryCancelled when the query failed or was cancelled.
+    # columns is known after the first row, rows and ms once the reply is complete
+    def __init__(self, client):
+        self.client = client
+        self.columns = None
+        self.messages = []
+        self.status = None
+        self.rows = None
+        self.ms = None
+
+    def __iter__(self):
+        while self.status is None:
+            line = self.client.file.readline()
+            if not line:
+                self.status = 'error'
+                self.messages.append("Connection closed by the server")
+                break
+            line = line.rstrip('\n')
+            if not line.startswith('-- '):
+                yield tuple(parseValue(value) for value in line.split(','))
+                continue
+            kind, unused, rest = line[3:].partition(' ')
+            if kind == 'columns':
+                self.columns = rest.split(',')
+            elif kind == 'message':
+                self.messages.append(rest)
+            else:
+                self.status = kind
+                fields = rest.split()
+                try:
+                    self.ms = float(fields[-1])
+                    if kind == 'ok':
+                        self.rows = int(fields[0])
+                except (IndexError, ValueError):
+                    self.messages.append(rest)
+        if self.client.current is self:
+            self.client.current = None
+        if self.status == 'error':
+            raise QueryError('\n'.join(self.messages))
+        if self.status == 'cancelled':
+            raise QueryCancelled()
+
+    def fetchall(self):
+        return list(self)
+
+    def drain(self):
+        # reads the rest of the reply, ignoring its outcome
+        try:
+            for row in self:
+                pass
+        except (QueryError, QueryCancelled):
+            pass
+
+class SqlClient(object):
+    # one connection to the streaming server. Replies come in order, so starting a query first
+    # reads whatever is left of the previous one
+    def __init__(self, address):
+        if address.find('/') != -1:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+        else:
+            host, port = address.rsplit(':', 1) if address.find(':') != -1 else ('localhost', address)
+            self.sock = socket.create_connection((host, int(port)))
+        self.file = self.sock.makefile('rb')
+        self.current = None
+
+    def query(self, query):
+        if self.current is not None:
+            self.current.drain()
+        self.sock.sendall(query.replace('\n', ' ') + '\n')
+        self.current = Result(self)
+        return self.current
+
+    def execute(self, query):
+        return self.query(query).fetchall()
+
+    def cancel(self):
+        # stops the running query; its result ends with QueryCancelled
+        self.sock.sendall("cancel\n")
+
+    def close(self):
+        try:
+            self.sock.sendall("quit\n")
+        except socket.error:
+            pass
+        self.file.close()
+        self.sock.close()
+
+def main():
+    if len(sys.argv) < 3:
+        print "Usage: python sqlclient.py HOST:PORT|/path/to/socket \"query\" ..."
+        sys.exit(2)
+    client = SqlClient(sys.argv[1])
+    signal.signal(signal.SIGINT, lambda signum, frame: client.cancel())
+    failed = False
+    for query in sys.argv[2:]:
+        result = client.query(query)
+        try:
+            for number, row in enumerate(result):
+                if number == 0:
+                    print ','.join(result.columns)
+                print ','.join("NULL" if value is None else str(value) for value in row)
+            print "-- %d row(s) in %.1f ms" % (result.rows, result.ms)
+        except QueryCancelled:
+            print "-- cancelled after %.1f ms" % result.ms
+        except QueryError as error:
+            print error
+            failed = True
+    client.close()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
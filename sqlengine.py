@@ -1,15 +1,935 @@
 #!/usr/bin/python
+import Queue
+import SocketServer
+import asynchat
+import asyncore
+import binascii
+import bisect
+import cPickle
 import csv
+import gc
+import heapq
+import json
+import mmap
+import multiprocessing
+import operator
 import os
+import re
+import signal
+import socket
+import struct
 import sys
+import tempfile
+import threading
+import time
+from StringIO import StringIO
+from array import array
+from itertools import chain, compress, count, imap, islice, izip, repeat
 from termcolor import colored
-from terminaltables import AsciiTable
-from collections import OrderedDict
-from pyparsing import Literal, CaselessLiteral, Word, delimitedList, Optional, \
-    Combine, Group, alphas, nums, alphanums, ParseException, Forward, oneOf, quotedString, \
-    ZeroOrMore, restOfLine, Keyword, upcaseTokens
+from collections import OrderedDict, deque
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+}
+OPERATOR_ALIASES = {'eq': '=', 'ne': '!=', 'lt': '<', 'gt': '>', 'le': '<=', 'ge': '>='}
+AGGREGATE_FUNCTIONS = ('sum', 'avg', 'average', 'min', 'max', 'count')
+AGGREGATE_ALIASES = {'average': 'avg'}
+# memory the DISTINCT hash set may use (estimated per key) before falling back to a sort-based distinct
+DISTINCT_MEMORY_BUDGET = 256 * 1024 * 1024
+DISTINCT_ENTRY_BYTES = 128
+DISTINCT_RUN_LENGTH = 1000000
+# memory the GROUP BY hash table may use (estimated per group); groups beyond it are hash
+# partitioned into this many temporary files and aggregated one partition at a time
+GROUP_MEMORY_BUDGET = 256 * 1024 * 1024
+GROUP_ENTRY_BYTES = 256
+GROUP_SPILL_PARTITIONS = 16
+# join planning: rows sampled per column for distinct-count estimates, the assumed selectivity of a
+# non-equality join condition, and the cost of comparing one row in a vectorized nested loop
+# relative to hashing one row
+DISTINCT_SAMPLE_ROWS = 10000
+THETA_JOIN_SELECTIVITY = 1.0 / 3
+NESTED_LOOP_ROW_COST = 0.1
+# a filter on fewer candidate rows than this fraction of the table checks them one by one
+# instead of comparing the whole column
+ROW_CHECK_FRACTION = 0.05
+# operator to use when the two sides of a comparison are swapped
+MIRRORED_OPERATORS = {'=': '=', '!=': '!=', '<': '>', '>': '<', '<=': '>=', '>=': '<='}
+NEGATED_OPERATORS = {'=': '!=', '!=': '=', '<': '>=', '>': '<=', '<=': '>', '>=': '<'}
+# binary column files cached next to every table#.csv; they store the array('l') buffers as they
+# are in memory, which the file format defines as 8-byte integers
+BINARY_TABLE_EXTENSION = '.tbl'
+BINARY_MAGIC = 'MSQLTBL2'
+BINARY_HEADER_FORMAT = '<8scdqqqI'
+BINARY_TABLES_SUPPORTED = array('l').itemsize == 8
+# rows per zone map block: every column keeps the min, max and NULL count of each block so that
+# literal comparisons can skip blocks
+ZONE_MAP_ROWS = 65536
+# worker processes used to parse CSV files, and the size of the byte ranges they are handed
+INGEST_WORKERS = multiprocessing.cpu_count()
+INGEST_CHUNK_BYTES = 8 * 1024 * 1024
+# lines per retry block when a CSV chunk is not plain integer rows, the size below which a failing
+# block is read cell by cell, and the characters integer rows are made of
+CSV_BLOCK_LINES = 65536
+CSV_ROW_LINES = 64
+CSV_INTEGER_CHARACTERS = '0123456789- \t,\n"'
+# secondary index files, written next to the CSV as table#.<column>.idx
+INDEX_EXTENSION = '.idx'
+INDEX_MAGIC = 'MSQLIDX1'
+INDEX_HEADER_FORMAT = '<8scc6xdqqq'
+# an index only replaces a WHERE scan when it selects at most this fraction of the table
+INDEX_SELECTIVITY = 0.125
+# bytes of table data kept in memory before least recently used tables are unloaded
+TABLE_CACHE_BUDGET = 1024 * 1024 * 1024
+# number of resolved query plans kept by the query cache
+QUERY_CACHE_SIZE = 512
+# intra-query parallelism: worker processes sharing the scans of one query (1 turns it off), rows
+# per morsel (a multiple of ZONE_MAP_ROWS), the smallest table that is scanned in parallel, and the
+# most groups or distinct values a parallel GROUP BY or DISTINCT may expect, as every worker hands
+# back its own hash table of them
+SCAN_WORKERS = multiprocessing.cpu_count()
+SCAN_MORSEL_ROWS = 4 * ZONE_MAP_ROWS
+PARALLEL_SCAN_ROWS = 2 * SCAN_MORSEL_ROWS
+PARALLEL_GROUP_LIMIT = 65536
+# equi-joins of tables with PARALLEL_SCAN_ROWS rows between them are radix partitioned on the
+# low bits of the join value into this many (as a power of two) partitions, joined independently
+JOIN_RADIX_BITS = 6
+# query server: worker processes running queries (0 runs them one at a time in the server
+# process), clients served at once, and queries a client may have waiting before its reads block
+SERVER_WORKERS = multiprocessing.cpu_count()
+SERVER_MAX_CONNECTIONS = 64
+SERVER_QUEUE_DEPTH = 16
+# streaming server: result rows sent per chunk, and bytes of results buffered for a slow client
+# before the query producing them is paused
+STREAM_CHUNK_ROWS = 1024
+STREAM_BUFFER_BYTES = 1024 * 1024
+# integer literals that are not part of an identifier such as table1
+LITERAL_PATTERN = re.compile(r"(?<![\w.])-?\d+(?![\w.])")
+SPACED_PUNCTUATION_PATTERN = re.compile(r"\s*([=<>!,()])\s*")
+# statement separators of a batch script, skipping quoted strings and -- comments
+STATEMENT_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"|--[^\n]*|;")
+COMMENT_PATTERN = re.compile(r"--[^\n]*")
+# tokens of the hand-written SQL parser. A name may carry a function call suffix such as
+# max(table1.a) or count(*), which is kept as part of the column name
+TOKEN_PATTERN = re.compile(r"""
+      (?P<space>\s+|--[^\n]*)
+    | (?P<number>[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:e[+-]?\d+)?)
+    | (?P<string>'[^']*'|"[^"]*")
+    | (?P<name>[a-z*][\w$*]*(?:\.[a-z*][\w$*]*)*(?:\([^()]*\))?)
+    | (?P<operator>!=|>=|<=|=|<|>)
+    | (?P<punctuation>[(),;])
+""", re.VERBOSE)
+RESERVED_WORDS = ('select', 'from', 'where', 'and', 'or', 'not', 'in', 'group', 'by', 'having', 'order', 'asc',
+                  'desc', 'limit', 'offset')
+WORD_OPERATORS = ('eq', 'ne', 'lt', 'le', 'gt', 'ge')
+
+class RowSet(object):
+    # selection of row ids over one table, stored as a byte-per-row bitmap sized to the table
+    __slots__ = ('mask',)
+
+    def __init__(self, mask):
+        self.mask = mask
+
+    @classmethod
+    def all(cls, size):
+        return cls(bytearray('\x01') * size)
+
+    @classmethod
+    def fromRows(cls, size, rows):
+        mask = bytearray(size)
+        for row in rows:
+            mask[row] = 1
+        return cls(mask)
+
+    def size(self):
+        return len(self.mask)
+
+    def __len__(self):
+        return self.mask.count('\x01')
+
+    def __nonzero__(self):
+        return '\x01' in self.mask
+
+    def __contains__(self, row):
+        return 0 <= row < len(self.mask) and self.mask[row] == 1
+
+    def __iter__(self):
+        return compress(xrange(len(self.mask)), self.mask)
+
+    # set operations run on the masks read as one big integer, every row being a 0x01 or 0x00 byte
+    def bits(self):
+        return long(binascii.hexlify(self.mask), 16)
+
+    def fromBits(self, bits):
+        return RowSet(bytearray(binascii.unhexlify('%0*x' % (2 * len(self.mask), bits))))
+
+    def __and__(self, other):
+        return self.fromBits(self.bits() & other.bits())
+
+    def __or__(self, other):
+        return self.fromBits(self.bits() | other.bits())
+
+    def __sub__(self, other):
+        return self.fromBits(self.bits() & ~other.bits())
+
+class Column(object):
+    # one table column: int64 values in a contiguous array plus a byte-per-row null bitmap.
+    # Columns of a binary table file start out as (mapping, offset, rows) and are copied out of
+    # the file mapping the first time a query touches them
+    __slots__ = ('name', 'buffers', 'source', 'stats', 'zones', 'distinct')
+
+    def __init__(self, name, values=None, nulls=None, source=None, zones=None):
+        self.name = name
+        self.source = source
+        self.buffers = None
+        if source is None:
+            self.buffers = (values if values is not None else array('l'), nulls if nulls is not None else bytearray())
+        self.stats = None
+        self.zones = zones
+        self.distinct = None
+
+    @property
+    def values(self):
+        return (self.buffers or self.map())[0]
+
+    @property
+    def nulls(self):
+        return (self.buffers or self.map())[1]
+
+    def map(self):
+        mapping, offset, rows = self.source
+        values = array('l')
+        values.fromstring(buffer(mapping, offset, rows * values.itemsize))
+        nulls = bytearray(buffer(mapping, offset + rows * values.itemsize, rows))
+        self.buffers = (values, nulls)
+        return self.buffers
+
+    def extend(self, values, nulls):
+        # appends a block of rows given as raw native int64 values and null bitmap bytes
+        self.stats = self.zones = self.distinct = None
+        self.values.fromstring(values)
+        self.nulls.extend(nulls)
+
+    def unmap(self):
+        # drops the copy of a column that can be mapped again from its binary table file
+        if self.source is not None:
+            self.buffers = None
+
+    def append(self, value):
+        self.stats = self.zones = self.distinct = None
+        if value is None:
+            self.values.append(0)
+            self.nulls.append(1)
+        else:
+            self.values.append(value)
+            self.nulls.append(0)
+
+    def bounds(self):
+        # (min, max) of the non-NULL values, computed once; None when there are none
+        if self.stats is None:
+            values = list(self.iterValues()) if self.hasNulls() else self.values
+            self.stats = (min(values), max(values)) if len(values) else ()
+        return self.stats or None
+
+    def distinctCount(self):
+        # estimated number of distinct non-NULL values, from an evenly spaced sample of at most
+        # DISTINCT_SAMPLE_ROWS rows (Haas' Duj1 estimator: the more sampled values occur only once,
+        # the more unseen ones are assumed)
+        if self.distinct is None:
+            size = len(self)
+            sample = list(self.iterValues(xrange(0, size, max(1, size // DISTINCT_SAMPLE_ROWS))))
+            counts = {}
+            for value in sample:
+                counts[value] = counts.get(value, 0) + 1
+            once = sum(1 for count in counts.itervalues() if count == 1)
+            present = size - self.nulls.count('\x01')
+            if not sample:
+                self.distinct = 0
+            elif once == len(sample):
+                self.distinct = present
+            else:
+                fraction = float(len(sample)) / max(present, 1)
+                estimate = len(counts) / (1 - (1 - fraction) * once / float(len(sample)))
+                self.distinct = min(present, int(estimate))
+        return self.distinct
+
+    def zoneMap(self):
+        # (min, max, NULL count) of every block of ZONE_MAP_ROWS rows, with min and max 0 for blocks
+        # holding only NULLs. Read from the binary table file, or computed on first use
+        if self.zones is None:
+            values, nulls = self.values, self.nulls
+            zones = []
+            for start in xrange(0, len(values), ZONE_MAP_ROWS):
+                end = start + ZONE_MAP_ROWS
+                block = values[start:end]
+                nullCount = nulls.count('\x01', start, end)
+                if nullCount:
+                    block = list(compress(block, imap(operator.not_, nulls[start:end])))
+                zones.append((min(block), max(block), nullCount) if len(block) else (0, 0, nullCount))
+            self.zones = zones
+        return self.zones
+
+    def block(self, start, end):
+        # values and nulls of rows [start, end), read straight from the file mapping while the
+        # column has not been copied out of it
+        if self.buffers is not None:
+            return self.buffers[0][start:end], self.buffers[1][start:end]
+        mapping, offset, rows = self.source
+        values = array('l')
+        values.fromstring(buffer(mapping, offset + start * values.itemsize, (end - start) * values.itemsize))
+        return values, bytearray(buffer(mapping, offset + rows * values.itemsize + start, end - start))
+
+    def hasNulls(self):
+        return '\x01' in self.nulls
+
+    def isNull(self, row):
+        return self.nulls[row] == 1
+
+    def __len__(self):
+        if self.buffers is None:
+            return self.source[2]
+        return len(self.values)
+
+    def __getitem__(self, row):
+        if self.nulls[row]:
+            return "NULL"
+        return self.values[row]
+
+    def cell(self, row):
+        # the value of one row like column[row], read straight from the file mapping while the
+        # column has not been copied out of it, for queries that only show a few rows
+        if self.buffers is not None:
+            return self[row]
+        values, nulls = self.block(row, row + 1)
+        return "NULL" if nulls[0] else values[0]
+
+    def __iter__(self):
+        if not self.hasNulls():
+            return iter(self.values)
+        return ("NULL" if isNull else value for value, isNull in izip(self.values, self.nulls))
+
+    def compare(self, operatorName, other, start=0, end=None):
+        # vectorized predicate kernel: compares the column (or its rows [start, end)) against a
+        # literal or another Column in one C-level pass, producing a RowSet of the matching
+        # non-NULL rows of that range
+        function = OPERATORS[operatorName]
+        if not isinstance(other, Column):
+            return self.compareZones(operatorName, other, start, end)
+        if end is None:
+            (values, nulls), (otherValues, otherNulls) = self.buffers or self.map(), other.buffers or other.map()
+        else:
+            (values, nulls), (otherValues, otherNulls) = self.block(start, end), other.block(start, end)
+        mask = bytearray(imap(function, values, otherValues))
+        if '\x01' in otherNulls:
+            mask = bytearray(imap(operator.gt, mask, otherNulls))
+        if '\x01' in nulls:
+            mask = bytearray(imap(operator.gt, mask, nulls))
+        return RowSet(mask)
+
+    def compareZones(self, operatorName, value, start=0, end=None):
+        # literal comparison block by block: the zone map rules out blocks that cannot match and
+        # accepts blocks that match entirely, so only the remaining blocks are compared per row.
+        # A range of rows [start, end) starts at a multiple of ZONE_MAP_ROWS
+        function = OPERATORS[operatorName]
+        size = len(self) if end is None else end
+        zones = self.zoneMap()
+        blocks = []
+        for block in xrange(start // ZONE_MAP_ROWS, (size + ZONE_MAP_ROWS - 1) // ZONE_MAP_ROWS):
+            low, high, nullCount = zones[block]
+            blockStart = block * ZONE_MAP_ROWS
+            blockEnd = min(blockStart + ZONE_MAP_ROWS, size)
+            some, every = zoneMatch(operatorName, low, high, value)
+            if nullCount == blockEnd - blockStart or not some:
+                blocks.append((blockStart, blockEnd, '\x00'))
+            elif every and not nullCount:
+                blocks.append((blockStart, blockEnd, '\x01'))
+            else:
+                blocks.append((blockStart, blockEnd, nullCount))
+        if self.buffers is not None and not any(isinstance(fill, str) for blockStart, blockEnd, fill in blocks):
+            # nothing to skip: one pass over the whole range
+            values, nulls = self.buffers if end is None else self.block(start, end)
+            mask = bytearray(imap(function, values, repeat(value)))
+            if self.hasNulls():
+                mask = bytearray(imap(operator.gt, mask, nulls))
+            return RowSet(mask)
+
+        mask = bytearray()
+        for start, end, fill in blocks:
+            if isinstance(fill, str):
+                mask.extend(fill * (end - start))
+                continue
+            values, nulls = self.block(start, end)
+            part = bytearray(imap(function, values, repeat(value)))
+            if fill:
+                part = bytearray(imap(operator.gt, part, nulls))
+            mask.extend(part)
+        return RowSet(mask)
+
+    def iterValues(self, rows=None):
+        # non-NULL values of the given rows (every row when rows is None)
+        values, nulls = self.values, self.nulls
+        if rows is None:
+            if not self.hasNulls():
+                return iter(values)
+            return compress(values, imap(operator.not_, nulls))
+        return (values[row] for row in rows if not nulls[row])
+
+def zoneMatch(operatorName, low, high, value):
+    # (some, every): whether some or every value in [low, high] can satisfy "value op literal"
+    if operatorName == '=':
+        return low <= value <= high, low == high == value
+    if operatorName == '!=':
+        return not low == high == value, value < low or value > high
+    if operatorName in ('<', '<='):
+        return OPERATORS[operatorName](low, value), OPERATORS[operatorName](high, value)
+    return OPERATORS[operatorName](high, value), OPERATORS[operatorName](low, value)
+
+class SortedIndex(object):
+    # secondary index on one column: its non-NULL values in sorted order next to their row ids,
+    # which stay ascending within equal values. Equality and range predicates become bisections
+    kind = 'sorted'
+    __slots__ = ('column', 'keys', 'rows')
+
+    def __init__(self, column):
+        self.column = column
+        self.keys = None
+        self.rows = None
+
+    def build(self, column):
+        values = column.values
+        rows = xrange(len(values))
+        if column.hasNulls():
+            rows = compress(rows, imap(operator.not_, column.nulls))
+        order = sorted(rows, key=values.__getitem__)
+        self.setData(array('l', imap(values.__getitem__, order)), array('l', order))
+
+    def setData(self, keys, rows):
+        self.keys, self.rows = keys, rows
+
+    def unload(self):
+        self.keys = self.rows = None
+
+    def memoryUsage(self):
+        if self.keys is None:
+            return 0
+        return len(self.keys) * self.keys.itemsize * 2
+
+    def supports(self, operatorName):
+        return operatorName != '!='
+
+    def match(self, operatorName, value):
+        # row ids of the indexed column satisfying "column op value", in ascending order
+        keys = self.keys
+        if operatorName == '=':
+            low, high = bisect.bisect_left(keys, value), bisect.bisect_right(keys, value)
+            return self.rows[low:high]
+        elif operatorName == '<':
+            low, high = 0, bisect.bisect_left(keys, value)
+        elif operatorName == '<=':
+            low, high = 0, bisect.bisect_right(keys, value)
+        elif operatorName == '>':
+            low, high = bisect.bisect_right(keys, value), len(keys)
+        else:
+            low, high = bisect.bisect_left(keys, value), len(keys)
+        return sorted(self.rows[low:high])
+
+    def count(self, operatorName, value):
+        keys = self.keys
+        if operatorName == '=':
+            return bisect.bisect_right(keys, value) - bisect.bisect_left(keys, value)
+        elif operatorName == '<':
+            return bisect.bisect_left(keys, value)
+        elif operatorName == '<=':
+            return bisect.bisect_right(keys, value)
+        elif operatorName == '>':
+            return len(keys) - bisect.bisect_right(keys, value)
+        return len(keys) - bisect.bisect_left(keys, value)
+
+class HashIndex(SortedIndex):
+    # point lookup index: the same sorted row ids, reached through a dictionary of value ranges
+    kind = 'hash'
+    __slots__ = ('buckets',)
+
+    def __init__(self, column):
+        SortedIndex.__init__(self, column)
+        self.buckets = None
+
+    def setData(self, keys, rows):
+        SortedIndex.setData(self, keys, rows)
+        starts = [0]
+        starts.extend(compress(xrange(1, len(keys)), imap(operator.ne, keys, islice(keys, 1, None))))
+        ends = starts[1:] + [len(keys)]
+        self.buckets = dict(izip(imap(keys.__getitem__, starts), izip(starts, ends))) if len(keys) else {}
+
+    def unload(self):
+        SortedIndex.unload(self)
+        self.buckets = None
+
+    def memoryUsage(self):
+        if self.buckets is None:
+            return 0
+        return SortedIndex.memoryUsage(self) + len(self.buckets) * 100
+
+    def supports(self, operatorName):
+        return operatorName == '='
+
+    def match(self, operatorName, value):
+        bounds = self.buckets.get(value)
+        if bounds is None:
+            return ()
+        return self.rows[bounds[0]:bounds[1]]
+
+    def count(self, operatorName, value):
+        bounds = self.buckets.get(value)
+        return bounds[1] - bounds[0] if bounds else 0
+
+INDEX_TYPES = OrderedDict([('sorted', SortedIndex), ('hash', HashIndex)])
+
+class Table(object):
+    # ordered collection of equally long Columns, keyed by column name. A table registered from
+    # metadata.txt knows its schema straight away and asks its loader for the data on first use
+    __slots__ = ('name', 'names', 'columns', 'path', 'loader', 'indexes')
+
+    def __init__(self, name, columnNames, path=None, loader=None):
+        self.name = name
+        self.names = list(columnNames)
+        self.path = path
+        self.loader = loader
+        self.indexes = {}
+        self.columns = None
+        if loader is None:
+            self.columns = OrderedDict((col, Column(col)) for col in self.names)
+
+    def data(self):
+        if self.loader is not None:
+            self.loader(self)
+        return self.columns
+
+    def unload(self):
+        if self.loader is not None:
+            self.columns = None
+            for index in self.indexes.itervalues():
+                index.unload()
+
+    def addIndex(self, col, kind):
+        if col not in self.indexes or self.indexes[col].kind != kind:
+            self.indexes[col] = INDEX_TYPES[kind](col)
+
+    def index(self, col):
+        # the loaded index on a column, or None; indexes are read from (or built and written to)
+        # their file together with the table data
+        index = self.indexes.get(col)
+        if index is None:
+            return None
+        self.data()
+        if index.keys is None:
+            loadIndex(self, index)
+        return index
+
+    def memoryUsage(self):
+        # bytes held by column buffers and indexes; mapped columns that were never touched cost nothing
+        if self.columns is None:
+            return 0
+        usage = sum(index.memoryUsage() for index in self.indexes.itervalues())
+        for column in self.columns.itervalues():
+            if column.buffers is not None:
+                usage += len(column.buffers[0]) * column.buffers[0].itemsize + len(column.buffers[1])
+        return usage
+
+    def numRows(self):
+        for column in self.data().itervalues():
+            return len(column)
+        return 0
+
+    def appendRow(self, row):
+        for column, value in izip(self.data().itervalues(), row):
+            column.append(value)
+
+    def __contains__(self, col):
+        return col in self.names
+
+    def __getitem__(self, col):
+        return self.data()[col]
+
+    def __iter__(self):
+        return iter(self.names)
+
+class TableCache(object):
+    # the tables listed in metadata.txt. A table's data is only loaded when a query first uses
+    # it, and loaded tables are kept in LRU order: once their buffers exceed the budget (in
+    # bytes) the least recently used ones are dropped and reloaded on their next use
+    def __init__(self, budget):
+        self.budget = budget
+        self.tables = OrderedDict()
+        self.loaded = OrderedDict()
+        self.working = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def register(self, name, columnNames, path=None):
+        self.tables[name] = Table(name, columnNames, path, self.use)
+
+    def use(self, table):
+        self.load([table])
+
+    def prefetch(self, names, columns=None):
+        # loads the tables of a query together, so that all of their CSVs lacking a current
+        # binary copy are parsed in one parallel pass. columns maps each table to the columns the
+        # query reads; those are kept over any others when memory runs short
+        self.working = columns or {}
+        self.load([self.tables[name.lower()] for name in names])
+
+    def load(self, tables):
+        pending = [table for table in tables if table.columns is None]
+        if pending:
+            for table, columns in izip(pending, readTableColumns(pending)):
+                table.columns = columns
+                self.loads += 1
+        for table in tables:
+            self.loaded.pop(table.name, None)
+            self.loaded[table.name] = table
+        self.evict(tables)
+
+    def evict(self, keep):
+        # first releases the copied-out columns that the current query does not read (they are
+        # mapped again from the binary file when needed), then whole tables in LRU order
+        usage = sum(table.memoryUsage() for table in self.loaded.itervalues())
+        if usage > self.budget:
+            for table in self.loaded.itervalues():
+                needed = self.working.get(table.name, ())
+                for col, column in table.columns.iteritems():
+                    if col not in needed:
+                        column.unmap()
+            usage = sum(table.memoryUsage() for table in self.loaded.itervalues())
+        for name in list(self.loaded):
+            if usage <= self.budget:
+                break
+            table = self.loaded[name]
+            if table in keep:
+                continue
+            usage -= table.memoryUsage()
+            del self.loaded[name]
+            table.unload()
+            self.evictions += 1
+
+    def preload(self):
+        # loads every table and copies its columns out of the binary files (as far as the budget
+        # allows), e.g. so that forked worker processes share those buffers
+        self.prefetch(list(self.tables))
+        for table in self.loaded.itervalues():
+            for column in table.columns.itervalues():
+                column.values
+        self.evict([])
+
+    def stats(self):
+        usage = sum(table.memoryUsage() for table in self.loaded.itervalues())
+        return "%d of %d tables loaded, %.1f MB in memory, %d loads, %d evictions" % \
+            (len(self.loaded), len(self.tables), usage / 1048576.0, self.loads, self.evictions)
+
+    def __contains__(self, name):
+        return name in self.tables
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def __iter__(self):
+        return iter(self.tables)
+
+class QueryCache(object):
+    # LRU cache of resolved query plans, keyed by the normalized query text with its literals
+    # replaced by '?', so queries that only differ in their constants share one plan
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        plan = self.entries.pop(key, None)
+        if plan is None:
+            self.misses += 1
+            return None
+        self.entries[key] = plan
+        self.hits += 1
+        return plan
+
+    def put(self, key, plan):
+        self.entries.pop(key, None)
+        self.entries[key] = plan
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def invalidate(self):
+        # plans hold resolved table and column references, so any schema change drops them all
+        self.entries.clear()
+
+    def stats(self):
+        return "%d plans cached, %d hits, %d misses" % (len(self.entries), self.hits, self.misses)
+
+queryCache = QueryCache(QUERY_CACHE_SIZE)
+
+def morselRanges(size):
+    return [(start, min(start + SCAN_MORSEL_ROWS, size)) for start in xrange(0, size, SCAN_MORSEL_ROWS)]
+
+class ScanPool(object):
+    # worker processes for morsel-driven scans: the rows of a big table are cut into morsels of
+    # SCAN_MORSEL_ROWS that the workers filter and aggregate independently, and their partial
+    # results are merged. The workers are forked from the engine so they see the loaded tables,
+    # and are forked again once a table was (re)loaded since. The pool is kept between queries
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = None
+        self.generation = None
+
+    def parallel(self, size):
+        # whether size rows are worth scanning in parallel. Worker processes of a pool cannot start
+        # a pool of their own
+        return self.workers > 1 and size >= PARALLEL_SCAN_ROWS and not multiprocessing.current_process().daemon
+
+    def morsels(self, size):
+        # row ranges to scan a table of size rows in, or None when it is scanned serially
+        return morselRanges(size) if self.parallel(size) else None
+
+    def map(self, function, tasks):
+        generation = (id(databases), databases.loads)
+        if self.pool is None or self.generation != generation:
+            self.close()
+            self.pool = multiprocessing.Pool(self.workers, ignoreInterrupts)
+            self.generation = generation
+        # waiting with a timeout keeps Ctrl-C working
+        return self.pool.map_async(function, tasks, 1).get(1 << 30)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+scanPool = ScanPool(SCAN_WORKERS)
+
+class SQLSyntaxError(Exception):
+    pass
+
+class ParsedQuery(object):
+    # parse result with the same columns/tables/where/distinct layout as the pyparsing grammar
+    def __init__(self):
+        self.distinct = ''
+        self.columns = []
+        self.tables = []
+        self.where = ['']
+        self.groupBy = []
+        self.having = ['']
+        self.orderBy = []
+        self.limit = []
+
+def syntaxError(expected, query, position):
+    line = query.count('\n', 0, position) + 1
+    col = position - query.rfind('\n', 0, position)
+    return SQLSyntaxError("Expected %s (at char %d), (line:%d, col:%d)" % (expected, position, line, col))
+
+def tokenizeSQL(query):
+    tokens = []
+    position = 0
+    match = TOKEN_PATTERN.match
+    while position < len(query):
+        found = match(query, position)
+        if found is None:
+            raise syntaxError("a valid token", query, position)
+        kind, value, end = found.lastgroup, found.group(found.lastgroup), found.end()
+        if kind == 'name' and value.find('(') != -1 and value[:value.find('(')] in RESERVED_WORDS:
+            # where(a=1) is the keyword followed by a parenthesis, not a function call
+            value = value[:value.find('(')]
+            end = position + len(value)
+        if kind != 'space':
+            tokens.append((kind, value, position))
+        position = end
+    tokens.append(('end', '', len(query)))
+    return tokens
+
+class SQLParser(object):
+    # recursive-descent parser for the select statements understood by the engine
+    def __init__(self, query):
+        self.query = query
+        self.tokens = tokenizeSQL(query)
+        self.index = 0
+
+    def peek(self):
+        return self.tokens[self.index]
+
+    def advance(self):
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def error(self, expected):
+        raise syntaxError(expected, self.query, self.peek()[2])
+
+    def acceptWord(self, word):
+        kind, value, position = self.peek()
+        if kind == 'name' and value == word:
+            self.index += 1
+            return True
+        return False
+
+    def acceptPunctuation(self, symbol):
+        kind, value, position = self.peek()
+        if kind == 'punctuation' and value == symbol:
+            self.index += 1
+            return True
+        return False
+
+    def expectWord(self, word):
+        if not self.acceptWord(word):
+            self.error('"%s"' % word)
+
+    def expectPunctuation(self, symbol):
+        if not self.acceptPunctuation(symbol):
+            self.error('"%s"' % symbol)
+
+    def parseName(self):
+        if self.peek()[0] != 'name':
+            self.error("identifier")
+        return self.advance()[1].upper()
+
+    def parseNameList(self):
+        names = [self.parseName()]
+        while self.acceptPunctuation(','):
+            names.append(self.parseName())
+        return names
+
+    def parseOperand(self):
+        kind, value, position = self.peek()
+        if kind == 'number':
+            self.index += 1
+            return value.upper()
+        if kind == 'string':
+            self.index += 1
+            return value
+        return self.parseName()
+
+    def parseOperator(self):
+        kind, value, position = self.peek()
+        if kind == 'operator' or (kind == 'name' and value in WORD_OPERATORS):
+            self.index += 1
+            return value
+        self.error("comparison operator")
+
+    def parseCondition(self):
+        if self.acceptWord('not'):
+            return ['not', self.parseCondition()]
+        if self.acceptPunctuation('('):
+            expression = self.parseWhereExpression()
+            self.expectPunctuation(')')
+            return ['('] + expression + [')']
+        left = self.parseOperand()
+        if self.acceptWord('in'):
+            self.expectPunctuation('(')
+            values = [self.parseOperand()]
+            while self.acceptPunctuation(','):
+                values.append(self.parseOperand())
+            self.expectPunctuation(')')
+            return [left, 'in', '('] + values + [')']
+        operatorName = self.parseOperator()
+        return [left, operatorName, self.parseOperand()]
+
+    def parseOrderItem(self):
+        name = self.parseName()
+        for direction in ('asc', 'desc'):
+            if self.acceptWord(direction):
+                return [name, direction]
+        return [name, 'asc']
+
+    def parseCount(self):
+        kind, value, position = self.peek()
+        if kind != 'number' or not value.isdigit():
+            self.error("non-negative integer")
+        self.index += 1
+        return value
+
+    def parseWhereExpression(self):
+        expression = [self.parseCondition()]
+        while self.peek()[0] == 'name' and self.peek()[1] in ('and', 'or'):
+            expression.append(self.advance()[1])
+            expression.append(self.parseCondition())
+        return expression
+
+    def parseSelect(self):
+        result = ParsedQuery()
+        self.expectWord('select')
+        if self.acceptWord('distinct'):
+            result.distinct = 'distinct'
+        if self.acceptWord('*'):
+            result.columns = ['*']
+        else:
+            result.columns = self.parseNameList()
+        self.expectWord('from')
+        result.tables = self.parseNameList()
+        if self.acceptWord('where'):
+            result.where = [['where'] + self.parseWhereExpression()]
+        if self.acceptWord('group'):
+            self.expectWord('by')
+            result.groupBy = self.parseNameList()
+        if self.acceptWord('having'):
+            result.having = [['having'] + self.parseWhereExpression()]
+        if self.acceptWord('order'):
+            self.expectWord('by')
+            result.orderBy = [self.parseOrderItem()]
+            while self.acceptPunctuation(','):
+                result.orderBy.append(self.parseOrderItem())
+        if self.acceptWord('limit'):
+            result.limit = [self.parseCount()]
+            if self.acceptWord('offset'):
+                result.limit.append(self.parseCount())
+        self.acceptPunctuation(';')
+        if self.peek()[0] != 'end':
+            self.error("end of text")
+        return result
+
+    def parseCreateIndex(self):
+        # create index on table(column) [using hash|sorted]
+        self.expectWord('create')
+        self.expectWord('index')
+        self.expectWord('on')
+        position = self.peek()[2]
+        table = self.parseName()
+        if table.find('(') != -1:
+            # table(column) is tokenized like a function call
+            column = table[table.find('(') + 1 : -1].strip()
+            table = table[:table.find('(')]
+            if not re.match(r"^[A-Z][\w$]*$", column):
+                raise syntaxError("a single column name", self.query, position + len(table) + 1)
+        else:
+            self.expectPunctuation('(')
+            column = self.parseName()
+            self.expectPunctuation(')')
+        kind = 'sorted'
+        if self.acceptWord('using'):
+            if self.peek()[0] != 'name' or self.peek()[1] not in INDEX_TYPES:
+                self.error(" or ".join('"%s"' % name for name in INDEX_TYPES))
+            kind = self.advance()[1]
+        self.acceptPunctuation(';')
+        if self.peek()[0] != 'end':
+            self.error("end of text")
+        return table, column, kind
+
+def parseSQL(inputQuery):
+    return SQLParser(inputQuery).parseSelect()
+
+def loadParser(usePyparsing=False):
+    # the hand-written parser is the default; the original pyparsing grammar is only imported
+    # (and its startup cost paid) when explicitly requested
+    global sqlParser
+    if not usePyparsing:
+        sqlParser = parseSQL
+        return
+
+    from pyparsing import CaselessLiteral, Word, delimitedList, Optional, Combine, Group, alphas, \
+        nums, alphanums, ParseException, Forward, oneOf, quotedString, ZeroOrMore, restOfLine, \
+        Keyword, upcaseTokens
 
-def loadParser():
     # simple demo of using the parsing library to do simple-minded SQL parsing
     # could be extended to include where clauses etc.
     #
@@ -19,8 +939,15 @@ def loadParser():
     SELECT = Keyword("select", caseless=True)
     FROM = Keyword("from", caseless=True)
     WHERE = Keyword("where", caseless=True)
+    GROUP_BY = Keyword("group", caseless=True) + Keyword("by", caseless=True)
+    HAVING = Keyword("having", caseless=True)
+    ORDER_BY = Keyword("order", caseless=True) + Keyword("by", caseless=True)
+    LIMIT = Keyword("limit", caseless=True)
+    OFFSET = Keyword("offset", caseless=True)
+    # '(' counts as part of the keyword so that the distinct(col) function form is left alone
+    DISTINCT = Keyword("distinct", identChars=alphanums + "_$(", caseless=True)
 
-    ident          = Word( alphas + '*', alphanums + "_$()" ).setName("identifier")
+    ident          = Word( alphas + '*', alphanums + "_$()*" ).setName("identifier")
     columnName     = ( delimitedList( ident, ".", combine=True ) ).setName("column name").addParseAction(upcaseTokens)
     columnNameList = Group( delimitedList( columnName ) )
     tableName      = ( delimitedList( ident, ".", combine=True ) ).setName("table name").addParseAction(upcaseTokens)
@@ -30,6 +957,7 @@ def loadParser():
     and_ = Keyword("and", caseless=True)
     or_ = Keyword("or", caseless=True)
     in_ = Keyword("in", caseless=True)
+    not_ = Keyword("not", caseless=True)
 
     E = CaselessLiteral("E")
     binop = oneOf("= != < > >= <= eq ne lt le gt ge", caseless=True)
@@ -41,7 +969,9 @@ def loadParser():
                 Optional( E + Optional("+") + Word(nums) ) )
 
     columnRval = realNum | intNum | quotedString | columnName # need to add support for alg expressions
-    whereCondition = Group(
+    whereCondition = Forward()
+    whereCondition << Group(
+        ( not_ + whereCondition ) |
         ( columnRval + binop + columnRval ) |
         ( columnRval + binop + columnName ) |
         ( columnName + binop + columnRval ) |
@@ -50,27 +980,41 @@ def loadParser():
         ( "(" + whereExpression + ")" )
         )
     whereExpression << whereCondition + ZeroOrMore( ( and_ | or_ ) + whereExpression ) 
+    orderItem = Group( columnName + Optional( oneOf("asc desc", caseless=True), "asc" ) )
 
-    selectStmt <<= (SELECT + ('*' | columnNameList)("columns") + 
+    selectStmt <<= (SELECT + Optional(DISTINCT)("distinct") + ('*' | columnNameList)("columns") + 
                     FROM + tableNameList( "tables" ) + 
-                    Optional(Group(WHERE + whereExpression), "")("where"))
+                    Optional(Group(WHERE + whereExpression), "")("where") +
+                    Optional(GROUP_BY.suppress() + columnNameList("groupBy")) +
+                    Optional(Group(HAVING + whereExpression), "")("having") +
+                    Optional(ORDER_BY.suppress() + Group(delimitedList(orderItem))("orderBy")) +
+                    Optional(LIMIT.suppress() + Group(Word(nums) + Optional(OFFSET.suppress() + Word(nums)))("limit")))
     global simpleSQL
 
     simpleSQL = selectStmt
     oracleSqlComment = "--" + restOfLine
     simpleSQL.ignore( oracleSqlComment )
 
+    def parsePyparsing(inputQuery):
+        try:
+            return simpleSQL.parseString( inputQuery )
+        except ParseException, err:
+            raise SQLSyntaxError(str(err))
+    sqlParser = parsePyparsing
+
 def parseQuery(inputQuery):
     try:
         inputQuery = inputQuery.lower()
-        tokens = simpleSQL.parseString( inputQuery )
-        columns = tokens.columns
-        tables = tokens.tables
-        where = tokens.where
-        # print columns
-        # print columns, tables, where
-        return columns, tables, where
-    except ParseException, err:
+        tokens = sqlParser( inputQuery )
+        # print tokens.columns, tokens.tables, tokens.where
+        return tokens
+    except SQLSyntaxError, err:
+        print colored("[ERROR]", 'red'), err
+
+def parseIndexStatement(inputQuery):
+    try:
+        return SQLParser(inputQuery.lower()).parseCreateIndex()
+    except SQLSyntaxError, err:
         print colored("[ERROR]", 'red'), err
 
 def getFiles(path):
@@ -96,6 +1040,327 @@ def group(seq, sep):
         g.append(el)
     yield g
 
+def readTableColumns(tables):
+    # the columns of registered tables: mapped from their binary copies when those are current,
+    # otherwise parsed from the CSVs, which also refreshes the binary copies
+    results = []
+    parsed = []
+    for table in tables:
+        columns = OrderedDict((col, Column(col)) for col in table.names)
+        if table.path is not None:
+            csvStat = os.stat(table.path)
+            binaryPath = os.path.splitext(table.path)[0] + BINARY_TABLE_EXTENSION
+            mapped = loadBinaryTable(binaryPath, table.names, csvStat)
+            if mapped is not None:
+                columns = mapped
+            else:
+                parsed.append((table, columns, binaryPath, csvStat))
+        results.append(columns)
+    loadCSVTables([(parsedTable.path, parsedTable.name, tableColumns)
+                   for parsedTable, tableColumns, tablePath, tableStat in parsed])
+    for table, columns, binaryPath, csvStat in parsed:
+        writeBinaryTable(binaryPath, columns, csvStat)
+        # switch to the new binary copy so that only the columns queries read stay in memory
+        mapped = loadBinaryTable(binaryPath, table.names, csvStat)
+        if mapped is not None:
+            results[tables.index(table)] = mapped
+    return results
+
+def csvChunks(csvPath):
+    # splits a CSV into byte ranges of about INGEST_CHUNK_BYTES, each ending on a line boundary
+    size = os.path.getsize(csvPath)
+    chunks = []
+    with open(csvPath, 'rb') as source:
+        start = 0
+        while start < size:
+            source.seek(min(start + INGEST_CHUNK_BYTES, size))
+            source.readline()
+            end = min(source.tell(), size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+def unquoteCSVText(text):
+    # drops the quotes of a block whose quoted cells each hold a whole value, or returns None when
+    # dropping them would change the cells: a quote left open, a separator inside a quoted cell,
+    # or a quote inside a cell
+    pieces = text.split('"')
+    quoted = len(pieces) // 2
+    inside = ''.join(pieces[1::2])
+    if len(pieces) % 2 == 0 or ',' in inside or '\n' in inside:
+        return None
+    # every quoted cell, replaced by a marker, must start a cell and end one
+    marked = '\0'.join(pieces[0::2])
+    opened = sum(marked.count(separator + '\0') for separator in ', \t\n') + marked.startswith('\0')
+    closed = sum(marked.count('\0' + separator) for separator in ',\n') + marked.endswith('\0')
+    if opened != quoted or closed != quoted:
+        return None
+    return ''.join(pieces)
+
+def parseCSVText(text, columns):
+    # bulk path for a block of plain or quoted integer rows: the quotes are dropped, every line
+    # break becomes a null marker and the whole block is converted by the C JSON scanner in one
+    # call. The markers must then sit exactly after every width cells, and the columns are cut out
+    # as strided slices. Returns False, without touching the columns, when the block holds
+    # anything else (short rows, blank or malformed cells, leading zeros, quoted separators)
+    width = len(columns)
+    if not text or text.translate(None, CSV_INTEGER_CHARACTERS):
+        return False
+    if '"' in text:
+        text = unquoteCSVText(text)
+        if text is None:
+            return False
+    rows = text.count('\n') + 1
+    try:
+        cells = json.loads('[' + text.replace('\n', ',null,') + ',null]')
+    except ValueError:
+        return False
+    # the text has no letters, so the only nulls are the markers
+    if len(cells) != rows * (width + 1) or cells[width::width + 1] != [None] * rows:
+        return False
+    blocks = [array('l') for it in xrange(width)]
+    try:
+        for it, values in enumerate(blocks):
+            values.fromlist(cells[it::width + 1])
+    except OverflowError:
+        return False
+    nulls = bytearray(rows)
+    for column, values in izip(columns, blocks):
+        column.values.extend(values)
+        column.nulls.extend(nulls)
+    return True
+
+def parseCSVRows(lines, columns, invalid):
+    # cell by cell fallback; unreadable cells are stored as NULL and counted per column
+    for row in csv.reader(lines, delimiter=',', skipinitialspace=True):
+        for it, column in enumerate(columns):
+            try:
+                column.append(int(row[it]))
+            except:
+                invalid[it] += 1
+                column.append(None)
+
+def parseCSVBlock(lines, columns, invalid):
+    # a block that is not all integer rows is halved until the parts holding the bad rows are
+    # down to CSV_ROW_LINES, which are read cell by cell, so sparse bad cells keep the rest of
+    # the block on the bulk path
+    if parseCSVText('\n'.join(lines), columns):
+        return
+    if len(lines) <= CSV_ROW_LINES:
+        parseCSVRows(lines, columns, invalid)
+        return
+    middle = len(lines) // 2
+    parseCSVBlock(lines[:middle], columns, invalid)
+    parseCSVBlock(lines[middle:], columns, invalid)
+
+def parseCSVChunk(task):
+    # parses one byte range of a CSV into per-column buffers. Runs in the ingest workers, so the
+    # result is a raw values string and null bitmap per column rather than per-row objects,
+    # along with the number of unreadable cells in each column. A chunk that is not plain
+    # integer rows is retried in blocks of CSV_BLOCK_LINES, each narrowed down to its bad rows
+    csvPath, start, end, width = task
+    with open(csvPath, 'rb') as source:
+        source.seek(start)
+        text = source.read(end - start)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n')
+    columns = [Column(None) for i in xrange(width)]
+    invalid = [0] * width
+    if not parseCSVText(text[:-1] if text.endswith('\n') else text, columns):
+        lines = text.splitlines()
+        for first in xrange(0, len(lines), CSV_BLOCK_LINES):
+            parseCSVBlock(lines[first : first + CSV_BLOCK_LINES], columns, invalid)
+    return [(column.values.tostring(), str(column.nulls)) for column in columns], invalid
+
+def parseCSVChunks(tasks):
+    if len(tasks) < 2 or INGEST_WORKERS < 2:
+        return map(parseCSVChunk, tasks)
+    pool = multiprocessing.Pool(min(INGEST_WORKERS, len(tasks)))
+    try:
+        return pool.map(parseCSVChunk, tasks, 1)
+    finally:
+        pool.terminate()
+
+def loadCSVTables(tables):
+    # parses the CSVs of several tables in one pass: every file is cut into byte ranges that the
+    # ingest pool parses in parallel, and the column buffers are concatenated in file order
+    tasks = []
+    chunkCounts = []
+    for csvPath, tableName, columns in tables:
+        chunks = csvChunks(csvPath)
+        tasks.extend((csvPath, start, end, len(columns)) for start, end in chunks)
+        chunkCounts.append(len(chunks))
+    results = iter(parseCSVChunks(tasks))
+    for (csvPath, tableName, columns), chunkCount in izip(tables, chunkCounts):
+        chunks = list(islice(results, chunkCount))
+        if not chunks:
+            print colored("[INFO]",'red'),tableName, " database is empty."
+        invalid = [0] * len(columns)
+        for buffers, chunkInvalid in chunks:
+            for column, (values, nulls) in izip(columns.itervalues(), buffers):
+                column.extend(values, nulls)
+            invalid = map(operator.add, invalid, chunkInvalid)
+        for col, invalidCount in izip(columns, invalid):
+            if invalidCount:
+                print colored("[ERROR]",'red'),"Cannot read %d value(s) of %s.%s, make sure values are integral. Storing NULL" % (invalidCount, tableName, col)
+
+def binaryPadding(length):
+    return '\0' * (-length % 8)
+
+def writeBinaryTable(binaryPath, columns, csvStat):
+    # binary column file written next to the CSV: a header with the CSV's mtime and size and the
+    # schema, followed by every column as native int64 values, its byte-per-row null bitmap and
+    # its zone map, each section 8-byte aligned so the file can be mapped and sliced directly
+    if not BINARY_TABLES_SUPPORTED:
+        return
+    names = list(columns)
+    rows = len(columns[names[0]]) if names else 0
+    header = struct.pack(BINARY_HEADER_FORMAT, BINARY_MAGIC, sys.byteorder[0], csvStat.st_mtime,
+                         csvStat.st_size, rows, ZONE_MAP_ROWS, len(names))
+    for name in names:
+        header += struct.pack('<H', len(name)) + name
+    header += binaryPadding(len(header))
+    temporaryPath = binaryPath + '.tmp'
+    try:
+        with open(temporaryPath, 'wb') as binary:
+            binary.write(header)
+            for name in names:
+                columns[name].values.tofile(binary)
+                binary.write(columns[name].nulls)
+                binary.write(binaryPadding(rows))
+                array('l', chain.from_iterable(columns[name].zoneMap())).tofile(binary)
+        os.rename(temporaryPath, binaryPath)
+    except (IOError, OSError):
+        # a read-only database directory just means the CSV is parsed on every start
+        pass
+
+def loadBinaryTable(binaryPath, columnNames, csvStat):
+    # maps the binary column file of a table; None when it is missing, was written for another
+    # version of the CSV (mtime or size differ) or does not match the schema in metadata.txt
+    if not BINARY_TABLES_SUPPORTED or not os.path.isfile(binaryPath):
+        return None
+    try:
+        with open(binaryPath, 'rb') as binary:
+            mapping = mmap.mmap(binary.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byteorder, mtime, size, rows, zoneRows, count = struct.unpack_from(BINARY_HEADER_FORMAT, mapping, 0)
+        if magic != BINARY_MAGIC or byteorder != sys.byteorder[0] or mtime != csvStat.st_mtime or size != csvStat.st_size:
+            return None
+        if zoneRows != ZONE_MAP_ROWS:
+            return None
+        offset = struct.calcsize(BINARY_HEADER_FORMAT)
+        names = []
+        for i in xrange(count):
+            length, = struct.unpack_from('<H', mapping, offset)
+            names.append(mapping[offset + 2 : offset + 2 + length])
+            offset += 2 + length
+        if names != list(columnNames):
+            return None
+        offset += -offset % 8
+        columns = OrderedDict()
+        blocks = (rows + ZONE_MAP_ROWS - 1) // ZONE_MAP_ROWS
+        for name in names:
+            zones = array('l')
+            zoneOffset = offset + rows * 8 + rows + (-rows % 8)
+            zones.fromstring(buffer(mapping, zoneOffset, blocks * 3 * 8))
+            columns[name] = Column(name, source=(mapping, offset, rows), zones=zip(*[iter(zones)] * 3))
+            offset = zoneOffset + blocks * 3 * 8
+        if offset > len(mapping):
+            return None
+        return columns
+    except (IOError, OSError, ValueError, struct.error):
+        return None
+
+def indexPath(table, col):
+    return os.path.splitext(table.path)[0] + '.' + col + INDEX_EXTENSION
+
+def loadIndex(table, index):
+    # reads the index file of a table column when it is current, otherwise builds the index from
+    # the column and writes the file
+    csvStat = os.stat(table.path) if table.path is not None else None
+    if csvStat is not None:
+        data = loadIndexFile(indexPath(table, index.column), index.kind, csvStat, table.numRows())
+        if data is not None:
+            index.setData(*data)
+            return
+    index.build(table[index.column])
+    if csvStat is not None:
+        writeIndexFile(indexPath(table, index.column), index, csvStat, table.numRows())
+
+def writeIndexFile(path, index, csvStat, rows):
+    # header with the index kind, the CSV's mtime and size and the table's row count, followed by
+    # the sorted values and their row ids as native int64 arrays
+    if not BINARY_TABLES_SUPPORTED:
+        return
+    header = struct.pack(INDEX_HEADER_FORMAT, INDEX_MAGIC, sys.byteorder[0], index.kind[0],
+                         csvStat.st_mtime, csvStat.st_size, rows, len(index.keys))
+    temporaryPath = path + '.tmp'
+    try:
+        with open(temporaryPath, 'wb') as indexFile:
+            indexFile.write(header)
+            index.keys.tofile(indexFile)
+            index.rows.tofile(indexFile)
+        os.rename(temporaryPath, path)
+    except (IOError, OSError):
+        pass
+
+def readIndexHeader(indexFile):
+    header = indexFile.read(struct.calcsize(INDEX_HEADER_FORMAT))
+    magic, byteorder, kind, mtime, size, rows, count = struct.unpack(INDEX_HEADER_FORMAT, header)
+    if magic != INDEX_MAGIC or byteorder != sys.byteorder[0]:
+        return None
+    for name in INDEX_TYPES:
+        if name[0] == kind:
+            return name, mtime, size, rows, count
+    return None
+
+def indexFileKind(path):
+    if not BINARY_TABLES_SUPPORTED:
+        return None
+    try:
+        with open(path, 'rb') as indexFile:
+            header = readIndexHeader(indexFile)
+        return header and header[0]
+    except (IOError, OSError, struct.error):
+        return None
+
+def loadIndexFile(path, kind, csvStat, rows):
+    # (keys, row ids) of an index file; None when it is missing, of another kind or stale
+    if not BINARY_TABLES_SUPPORTED or not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as indexFile:
+            header = readIndexHeader(indexFile)
+            if header is None or header[:4] != (kind, csvStat.st_mtime, csvStat.st_size, rows):
+                return None
+            keys, rowIds = array('l'), array('l')
+            keys.fromfile(indexFile, header[4])
+            rowIds.fromfile(indexFile, header[4])
+        return keys, rowIds
+    except (IOError, OSError, EOFError, struct.error):
+        return None
+
+def declareIndex(schema, tableName, col, kind):
+    if tableName.lower() not in schema:
+        print colored("[ERROR]", 'red')+ " Table %s doesn't exist in database" % tableName
+        return None
+    table = schema[tableName.lower()]
+    if col not in table:
+        print colored("[ERROR]", 'red')+ " Column %s not found in specified table(s)" % col
+        return None
+    table.addIndex(col, kind)
+    return table
+
+def createIndex(query):
+    statement = parseIndexStatement(query)
+    if statement is None:
+        return
+    table = declareIndex(databases, *statement)
+    if table is None:
+        return
+    table.index(statement[1])
+    print colored("[INFO]", 'green'), "Created %s index on %s(%s)" % (statement[2], table.name, statement[1])
+    return True
+
 def loadDatabases(path, files):
     if "metadata.txt" not in files:
         print colored("[ERROR]",'red'),"Metadata not found"
@@ -105,19 +1370,19 @@ def loadDatabases(path, files):
         try:
             with open(path + '/metadata.txt','r') as metadata:
                 content = metadata.read().splitlines()
+                # index declarations (create index on table(column) ...) may appear anywhere
+                declarations = [line for line in content if line.strip().lower().startswith('create ')]
+                content = [line for line in content if line not in declarations]
                 # print content
                 tables = list(group(content, "<begin_table>"))[1:]
                 # print tables
-                tableSchema = OrderedDict()
+                tableSchema = TableCache(TABLE_CACHE_BUDGET)
                 # global list_table_names = []
                 for table in tables:
                     # print table
                     tableName = table[1].lower()
                     # list_table_names.append(tableName)
-                    tableSchema[tableName] = OrderedDict()
-                    for col in table[2:-1]:
-                        # print col
-                        tableSchema[tableName][col] = []
+                    tableSchema.register(tableName, table[2:-1])
             # print tableSchema
 
             new_filelist = []
@@ -125,28 +1390,23 @@ def loadDatabases(path, files):
                 if file.lower().endswith('.csv'):
                     new_filelist.append(file)
             # print new_filelist
+            # tables are only registered here; their data is read when a query first needs it
             for file in new_filelist:
-                with open(path + '/' + file, 'r') as table:
-                    tableName = file.split('.')[0].lower()
-                    data = [row for row in csv.reader(table, delimiter=',', skipinitialspace=True)]
-                    # print data
-                    if not data:
-                        print colored("[INFO]",'red'),tableName, " database is empty."
-                        contents = []
-                    else:
-                        contents = data[0:]
-                    for row in contents:
-                        # print row
-                        it = 0
-                        for col in tableSchema[tableName]:
-                            try:
-                                # print tableName
-                                tableSchema[tableName][col].append(int(row[it]))
-                            except:
-                                print colored("[ERROR]",'red'),"Cannot read, make sure value is integral. Storing NULL"
-                                tableSchema[tableName][col].append("NULL")
-                            it += 1
+                tableName = file.split('.')[0].lower()
+                tableSchema[tableName].path = path + '/' + file
+            # indexes: the files left by earlier CREATE INDEX commands, then the metadata ones
+            for file in files:
+                if file.endswith(INDEX_EXTENSION) and file.count('.') == 2:
+                    tableName, col = file[:-len(INDEX_EXTENSION)].split('.')
+                    kind = indexFileKind(path + '/' + file)
+                    if kind and tableName.lower() in tableSchema and col in tableSchema[tableName.lower()]:
+                        tableSchema[tableName.lower()].addIndex(col, kind)
+            for declaration in declarations:
+                statement = parseIndexStatement(declaration)
+                if statement is not None:
+                    declareIndex(tableSchema, *statement)
             # print tableSchema
+            queryCache.invalidate()
             return tableSchema
 
         except:
@@ -174,7 +1434,7 @@ def checkTables(columns, tables):
                 print colored("[ERROR]", 'red')+ " Column %s not found in specified table(s)" % col
                 return False, table
 
-        elif col.find('*') != -1:
+        elif col.find('*') != -1 and col.find('(') == -1:
             # print "yoo2"
             for table in tables:
                 for header in databases[table.lower()]:
@@ -202,7 +1462,15 @@ def checkTables(columns, tables):
             index = col.find('(')
             endindex = col.find(')')
             function = col[:index]
-            if col.find('.') == -1:
+            if function.lower() not in AGGREGATE_FUNCTIONS and function.lower() != 'distinct':
+                print colored("[ERROR]", 'red')+ " Unknown function %s" % function
+                return False, tables[0]
+            if col[index + 1 : endindex] == '*':
+                if function.lower() != 'count':
+                    print colored("[ERROR]", 'red')+ " Column %s : syntax error" % col
+                    return False, tables[0]
+                colTableList.append([tables[0], '*', function])
+            elif col.find('.') == -1:
                 colName = col[index + 1 : endindex]
                 frequencyCol = 0
                 for table in tables:
@@ -235,484 +1503,1420 @@ def checkTables(columns, tables):
 
     return True, colTableList
 
-def checkConditions(where, tables):
-    conditions = []
-    conjunction = ""
-    queryConditions = where[0]
-    if(len(queryConditions) > 4):
-        print colored("[ERROR]", 'red') + " Too many conditions"
+def resolveOperand(operand, tables, aggregates=False):
+    # [literal] for a number, [table, column] for a column name and, when aggregates are
+    # allowed, [table, column, function] for max(col) and the like; None (after reporting the
+    # error) for an unknown or ambiguous column
+    if aggregates and operand.find('(') != -1:
+        bValid, entries = checkTables([operand], tables)
+        if not bValid:
+            return None
+        if entries[0][2].lower() not in AGGREGATE_FUNCTIONS:
+            print colored("[ERROR]", 'red')+ " Unknown function %s" % entries[0][2]
+            return None
+        return entries[0][:2] + [AGGREGATE_ALIASES.get(entries[0][2].lower(), entries[0][2].lower())]
+    indexDot = operand.find('.')
+    if indexDot == -1:
+        if operand.isdigit() or operand[:1] == '-':
+            return [operand]
+        side = None
+        for table in tables:
+            if operand in databases[table.lower()]:
+                if side is not None:
+                    print colored("[ERROR]", 'red')+ " Ambiguous column query %s after where" % operand
+                    return None
+                side = [table, operand]
+        if side is None:
+            print colored("[ERROR]", 'red')+ " Column %s not found in specified table(s)" % operand
+        return side
+    colTable = operand[:indexDot]
+    colName = operand[indexDot + 1: ]
+    for table in tables:
+        if colTable.lower() == table.lower():
+            if colName in databases[table.lower()]:
+                return [table, colName]
+            break
+    print colored("[ERROR]", 'red')+ " Column %s not found in specified table(s)" % operand
+    return None
+
+def buildCondition(item, tables, aggregates=False):
+    # one parsed WHERE item: a comparison, an IN list, NOT item or a parenthesized expression
+    if item[0] == 'not':
+        child = buildCondition(item[1], tables, aggregates)
+        return None if child is None else ['not', [child]]
+    if item[0] == '(':
+        return buildExpression(item[1:-1], tables, aggregates)
+    if len(item) > 3 and item[1] == 'in':
+        # A in (1, 2) is A = 1 or A = 2
+        items = []
+        for value in item[3:-1]:
+            items += ['or', [item[0], '=', value]]
+        return buildExpression(items[1:], tables, aggregates)
+    if len(item) != 3:
+        print colored("[ERROR]", 'red')+ " Syntax error in where clause"
+        return None
+    left, right = resolveOperand(item[0], tables, aggregates), resolveOperand(item[2], tables, aggregates)
+    if left is None or right is None:
+        return None
+    if len(left) == 1:
+        print colored("[ERROR]", 'red') + "Equate column to integer, not vice versa"
+        return None
+    return [left, right, OPERATOR_ALIASES.get(item[1], item[1])]
+
+def buildComparisons(children, connective):
+    return children[0] if len(children) == 1 else [connective, children]
+
+def buildExpression(items, tables, aggregates=False):
+    # [condition, 'and'|'or', condition, ...] into an expression tree where AND binds tighter
+    # than OR
+    terms = [[]]
+    for i in range(len(items)):
+        if i % 2:
+            if items[i] == 'or':
+                terms.append([])
+            continue
+        node = buildCondition(items[i], tables, aggregates)
+        if node is None:
+            return None
+        terms[-1].append(node)
+    return buildComparisons([buildComparisons(term, 'and') for term in terms], 'or')
+
+def isConnective(node):
+    return node[0] in ('and', 'or', 'not')
+
+def normalizeExpression(node, negate=False):
+    # pushes NOT down to the comparisons (De Morgan, negated operators, which also keeps NULLs
+    # excluded) and flattens nested ANDs and ORs, leaving a tree of and/or nodes over comparisons
+    if not isConnective(node):
+        if negate:
+            return [node[0], node[1], NEGATED_OPERATORS[node[2]]]
+        return node
+    if node[0] == 'not':
+        return normalizeExpression(node[1][0], not negate)
+    connective = node[0]
+    if negate:
+        connective = 'or' if connective == 'and' else 'and'
+    children = []
+    for child in node[1]:
+        child = normalizeExpression(child, negate)
+        if child[0] == connective:
+            children.extend(child[1])
+        else:
+            children.append(child)
+    return [connective, children]
+
+def iterComparisons(node):
+    # the comparisons of an expression in query text order
+    if node is None:
         return
-    for i in range(len(queryConditions)):
-        if i == 0:
+    if isConnective(node):
+        for child in node[1]:
+            for comparison in iterComparisons(child):
+                yield comparison
+    else:
+        yield node
+
+def expressionTables(node):
+    tables = set()
+    for comparison in iterComparisons(node):
+        for side in comparison[:2]:
+            if len(side) == 2:
+                tables.add(side[0])
+    return tables
+
+def checkConditions(where, tables, aggregates=False):
+    # the WHERE (or HAVING, with aggregates) clause as a normalized expression tree (None
+    # without one)
+    if not where[0]:
+        return True, None
+    expression = buildExpression(where[0][1:], tables, aggregates)
+    if expression is None:
+        return False, None
+    return True, normalizeExpression(expression)
+
+def checkGrouping(groupBy, tables):
+    # the [table, column] sides of the GROUP BY columns
+    grouping = []
+    for name in groupBy:
+        side = resolveOperand(name, tables)
+        if side is None:
+            return False, None
+        if len(side) == 1:
+            print colored("[ERROR]", 'red')+ " Cannot group by %s" % name
+            return False, None
+        grouping.append(side)
+    return True, grouping
+
+def checkOrdering(orderBy, tables, aggregated):
+    # [side, descending] for every ORDER BY item; aggregates are only allowed in aggregated queries
+    ordering = []
+    for name, direction in orderBy:
+        side = resolveOperand(name, tables, True)
+        if side is None:
+            return False, None
+        if len(side) == 1 or (len(side) == 3 and not aggregated):
+            print colored("[ERROR]", 'red')+ " Cannot order by %s" % name
+            return False, None
+        ordering.append([side, direction == 'desc'])
+    return True, ordering
+
+def tableLength(tableName):
+    return databases[tableName.lower()].numRows()
+
+def tableColumn(side):
+    return databases[side[0].lower()][side[1]]
+
+def tableIndex(side):
+    # the index on a [table, column] side, or None when the column has none
+    return databases[side[0].lower()].index(side[1])
+
+def iterRows(rows, size):
+    # the selected row ids of a table, or all of them when no filter applies
+    if rows is None:
+        return xrange(size)
+    return rows
+
+def rowsForTable(tableName, rowList):
+    for row in rowList:
+        if row[0] == tableName:
+            return row[1]
+    return None
+
+def isSorted(column):
+    values = column.values
+    return not column.hasNulls() and all(imap(operator.le, values, islice(values, 1, None)))
+
+def buildHashTable(column, rows=None):
+    hashTable = {}
+    values, nulls = column.values, column.nulls
+    for i in iterRows(rows, len(column)):
+        if nulls[i]:
+            continue
+        bucket = hashTable.get(values[i])
+        if bucket is None:
+            hashTable[values[i]] = [i]
+        else:
+            bucket.append(i)
+    return hashTable
+
+def hashJoin(firstColumn, secondColumn, firstRows=None, secondRows=None):
+    # build the hash table on the smaller input and probe it with the larger one
+    firstSize = len(firstColumn) if firstRows is None else len(firstRows)
+    secondSize = len(secondColumn) if secondRows is None else len(secondRows)
+    swapped = firstSize > secondSize
+    if swapped:
+        hashTable = buildHashTable(secondColumn, secondRows)
+        probeColumn, probeRows = firstColumn, firstRows
+    else:
+        hashTable = buildHashTable(firstColumn, firstRows)
+        probeColumn, probeRows = secondColumn, secondRows
+
+    values, nulls = probeColumn.values, probeColumn.nulls
+    for j in iterRows(probeRows, len(probeColumn)):
+        if nulls[j]:
+            continue
+        bucket = hashTable.get(values[j])
+        if bucket:
+            for i in bucket:
+                if swapped:
+                    yield j, i
+                else:
+                    yield i, j
+
+def partitionMorsel(task):
+    # the selected non-NULL rows among [start, end) of a join column, split by the low
+    # JOIN_RADIX_BITS bits of their value into one array of row ids per partition; runs in the
+    # scan workers
+    side, start, end, mask = task
+    values, nulls = tableColumn(side).block(start, end)
+    radix = (1 << JOIN_RADIX_BITS) - 1
+    partitions = [array('l') for i in xrange(radix + 1)]
+    keep = imap(operator.not_, nulls) if mask is None else imap(operator.gt, bytearray(mask), nulls)
+    for row in compress(xrange(end - start), keep):
+        partitions[values[row] & radix].append(start + row)
+    return [partition.tostring() for partition in partitions]
+
+def joinPartition(task):
+    # hash join of one partition of both sides, hashing the smaller one; returns the matching
+    # (first, second) row id pairs as two arrays. Runs in the scan workers
+    first, second, firstIds, secondIds = task
+    firstIds, secondIds = array('l', firstIds), array('l', secondIds)
+    pairs = hashJoin(tableColumn(first), tableColumn(second), firstIds, secondIds)
+    firstRows, secondRows = array('l'), array('l')
+    for i, j in pairs:
+        firstRows.append(i)
+        secondRows.append(j)
+    return firstRows.tostring(), secondRows.tostring()
+
+def partitionedHashJoin(first, second, firstRows=None, secondRows=None):
+    # radix partitioned hash join on the scan pool, or None when the tables are joined serially.
+    # The workers partition both sides morsel by morsel on the join value, then build and probe
+    # every pair of partitions independently. Yields the (first, second) row id pairs
+    firstSize, secondSize = tableLength(first[0]), tableLength(second[0])
+    if not scanPool.parallel(firstSize + secondSize):
+        return None
+    partitions = []
+    for side, rows, size in ((first, firstRows, firstSize), (second, secondRows, secondSize)):
+        tasks = [(side, start, end, None if rows is None else str(rows.mask[start:end]))
+                 for start, end in morselRanges(size)]
+        partitions.append([''.join(parts) for parts in izip(*scanPool.map(partitionMorsel, tasks))])
+    tasks = [(first, second, firstIds, secondIds) for firstIds, secondIds in izip(*partitions)
+             if firstIds and secondIds]
+    return chain.from_iterable(izip(array('l', firstIds), array('l', secondIds))
+                               for firstIds, secondIds in scanPool.map(joinPartition, tasks))
+
+def sortMergeJoin(firstColumn, secondColumn, firstRows=None, secondRows=None):
+    first, second = firstColumn.values, secondColumn.values
+    m, n = 0, 0
+    firstLen, secondLen = len(first), len(second)
+    while m < firstLen and n < secondLen:
+        if first[m] < second[n]:
+            m += 1
+        elif first[m] > second[n]:
+            n += 1
+        else:
+            # emit the cross product of the two runs of equal keys
+            firstEnd, secondEnd = m + 1, n + 1
+            while firstEnd < firstLen and first[firstEnd] == first[m]:
+                firstEnd += 1
+            while secondEnd < secondLen and second[secondEnd] == second[n]:
+                secondEnd += 1
+            matches = [j for j in xrange(n, secondEnd) if secondRows is None or j in secondRows]
+            for i in xrange(m, firstEnd):
+                if firstRows is None or i in firstRows:
+                    for j in matches:
+                        yield i, j
+            m, n = firstEnd, secondEnd
+
+def thetaJoin(firstColumn, secondColumn, operatorName, firstRows=None, secondRows=None):
+    # non-equality join: one vectorized comparison of the second column per first-column value
+    mirrored = MIRRORED_OPERATORS[operatorName]
+    for m in iterRows(firstRows, len(firstColumn)):
+        if firstColumn.isNull(m):
+            continue
+        matches = secondColumn.compare(mirrored, firstColumn.values[m])
+        if secondRows is not None:
+            matches = matches & secondRows
+        for n in matches:
+            yield m, n
+
+def indexJoin(probeColumn, buildIndex, operatorName, probeRows=None, buildRows=None):
+    # index nested-loop join: every probe row looks its value up in the index of the other column,
+    # so nothing is built or scanned per query. Yields (probeRow, buildRow) pairs
+    mirrored = MIRRORED_OPERATORS[operatorName]
+    values, nulls = probeColumn.values, probeColumn.nulls
+    for row in iterRows(probeRows, len(probeColumn)):
+        if nulls[row]:
             continue
-        elif i == 2:
-            conjunction = queryConditions[2]
+        for match in buildIndex.match(mirrored, values[row]):
+            if buildRows is None or match in buildRows:
+                yield row, match
+
+def swapPairs(pairs):
+    for first, second in pairs:
+        yield second, first
+
+def indexJoinCost(lookups, indexed):
+    # index entries an equality join reads when looking lookups values up in the index on the
+    # indexed side: every lookup returns about rows / distinct values matches, all of which are
+    # read even when the indexed table is filtered down to a few of them
+    column = tableColumn(indexed)
+    return lookups * max(1.0, float(len(column)) / max(1, column.distinctCount()))
+
+def joinPair(probe, build, operatorName, probeRows, buildRows, limited=False):
+    # picks the join algorithm for the first two tables: an index join when a column has a usable
+    # index, looking up the rows of the other side in it, unless hashing the smaller side is
+    # cheaper for an equality; otherwise merge/hash join for equality (radix partitioned on the
+    # scan pool for big tables, unless only the first rows are limited to) and a vectorized
+    # nested loop for other comparisons
+    probeColumn, buildColumn = tableColumn(probe), tableColumn(build)
+    probeSize = len(probeColumn) if probeRows is None else len(probeRows)
+    buildSize = len(buildColumn) if buildRows is None else len(buildRows)
+    if operatorName == '=' and isSorted(probeColumn) and isSorted(buildColumn):
+        return sortMergeJoin(probeColumn, buildColumn, probeRows, buildRows)
+    buildIndex, probeIndex = tableIndex(build), tableIndex(probe)
+    mirrored = MIRRORED_OPERATORS[operatorName]
+    candidates = []
+    if buildIndex is not None and buildIndex.supports(mirrored):
+        candidates.append((indexJoinCost(probeSize, build), 'build'))
+    if probeIndex is not None and probeIndex.supports(operatorName):
+        candidates.append((indexJoinCost(buildSize, probe), 'probe'))
+    if candidates:
+        cost, indexed = min(candidates)
+        # a hash join reads both sides once
+        if operatorName != '=' or cost < probeSize + buildSize:
+            if indexed == 'build':
+                return indexJoin(probeColumn, buildIndex, operatorName, probeRows, buildRows)
+            return swapPairs(indexJoin(buildColumn, probeIndex, mirrored, buildRows, probeRows))
+    if operatorName == '=':
+        pairs = None if limited else partitionedHashJoin(probe, build, probeRows, buildRows)
+        return pairs or hashJoin(probeColumn, buildColumn, probeRows, buildRows)
+    return thetaJoin(probeColumn, buildColumn, operatorName, probeRows, buildRows)
+
+def joinMethod(operatorName, build, buildIndex, probeEstimate, buildSize):
+    # how a stream of about probeEstimate tuples joins a table of buildSize (selected) rows: through
+    # the table's index when it can answer the comparison (for an equality only when the index
+    # entries read cost less than hashing the table once), else by hashing the table once for an
+    # equality unless a few vectorized scans of it are cheaper, else by a vectorized nested loop
+    if buildIndex is not None and buildIndex.supports(MIRRORED_OPERATORS[operatorName]) and \
+            (operatorName != '=' or indexJoinCost(probeEstimate, build) < probeEstimate + buildSize):
+        return 'index'
+    if operatorName == '=' and probeEstimate * buildSize * NESTED_LOOP_ROW_COST > buildSize:
+        return 'hash'
+    return 'loop'
+
+def probeJoin(stream, position, probeColumn, buildColumn, buildRows, operatorName, method, buildIndex=None):
+    # joins a stream of row id tuples with one more table using the given joinMethod: every tuple
+    # looks its value of the join column up in the new table's index, in a hash table built once
+    # over its rows, or compares it against the whole column
+    values, nulls = probeColumn.values, probeColumn.nulls
+    if method == 'index':
+        mirrored = MIRRORED_OPERATORS[operatorName]
+        for combo in stream:
+            row = combo[position]
+            if not nulls[row]:
+                for match in buildIndex.match(mirrored, values[row]):
+                    if buildRows is None or match in buildRows:
+                        yield combo + (match,)
+    elif method == 'hash':
+        hashTable = buildHashTable(buildColumn, buildRows)
+        for combo in stream:
+            row = combo[position]
+            if not nulls[row]:
+                for match in hashTable.get(values[row], ()):
+                    yield combo + (match,)
+    else:
+        mirrored = MIRRORED_OPERATORS[operatorName]
+        for combo in stream:
+            row = combo[position]
+            if nulls[row]:
+                continue
+            matches = buildColumn.compare(mirrored, values[row])
+            if buildRows is not None:
+                matches = matches & buildRows
+            for match in matches:
+                yield combo + (match,)
+
+def crossJoin(stream, rows, size):
+    for combo in stream:
+        for row in iterRows(rows, size):
+            yield combo + (row,)
+
+def isJoinCondition(condition):
+    return len(condition[0]) == 2 and len(condition[1]) == 2 and condition[0][0] != condition[1][0]
+
+def compileCondition(condition, positions):
+    # resolves the columns of a condition once and returns a test on row id tuples
+    operands = []
+    for side in condition[:2]:
+        if len(side) == 1:
+            operands.append((None, int(side[0])))
         else:
-            if len(queryConditions[i]) > 3:
-                print colored("[ERROR]", 'red')+ " Syntax error in where clause"
-                return
-            temp = []
-            for j in range(len(queryConditions[i])):
-                indexDot = queryConditions[i][j].find('.')
-                if j == 1:
+            operands.append((positions[side[0]], tableColumn(side)))
+    function = OPERATORS[condition[2]]
+
+    def test(combo):
+        values = []
+        for position, operand in operands:
+            if position is None:
+                values.append(operand)
+            elif operand.isNull(combo[position]):
+                return False
+            else:
+                values.append(operand.values[combo[position]])
+        return function(values[0], values[1])
+    return test
+
+def compileExpression(node, positions):
+    # fuses an expression tree into a single test on row id tuples. AND checks its most selective
+    # operand first and OR its least selective one, so either stops as early as possible
+    if not isConnective(node):
+        return compileCondition(node, positions)
+    children = sorted(node[1], key=expressionSelectivity, reverse=node[0] == 'or')
+    tests = [compileExpression(child, positions) for child in children]
+    combine = all if node[0] == 'and' else any
+
+    def test(combo):
+        return combine(check(combo) for check in tests)
+    return test
+
+def filterStream(stream, expression, order):
+    # row-at-a-time check for conditions that could not be pushed down to a single table scan
+    test = compileExpression(expression, dict((table, i) for i, table in enumerate(order)))
+    for combo in stream:
+        if test(combo):
+            yield combo
+
+def linksTo(conditions, table, joined):
+    # the join conditions between a table and any of the already joined tables
+    return [c for c in conditions if (c[0][0] == table and c[1][0] in joined) or (c[1][0] == table and c[0][0] in joined)]
+
+def joinSelectivity(condition):
+    if condition[2] != '=':
+        return THETA_JOIN_SELECTIVITY
+    return 1.0 / max(1, tableColumn(condition[0]).distinctCount(), tableColumn(condition[1]).distinctCount())
+
+def planJoinOrder(tables, rowList, joinConditions):
+    # cost-based join order: from every starting table, greedily add the linked table giving the
+    # smallest estimated intermediate result (cross products only once nothing is linked) and keep
+    # the order whose intermediate results add up to the least. Returns that order along with the
+    # estimated result size after each step
+    sizes = {}
+    for table in tables:
+        rows = rowsForTable(table, rowList)
+        sizes[table] = len(rows) if rows is not None else tableLength(table)
+    best = None
+    for first in tables:
+        order, estimates = [first], [sizes[first]]
+        while len(order) < len(tables):
+            candidates = []
+            for position, table in enumerate(tables):
+                if table in order:
                     continue
-                elif indexDot == -1:
-                    if queryConditions[i][j].isdigit() or queryConditions[i][j][:1] == '-':
-                        temp.append([queryConditions[i][j]])
-                    else:
-                        col = queryConditions[i][j]
-                        frequencyCol = 0
-                        for table in tables:
-                            if col in databases[table.lower()]:
-                                frequencyCol += 1
-                                temp.append([table, col])
-                            if frequencyCol > 1:
-                                print colored("[ERROR]", 'red')+ " Ambiguous column query %s after where" % col
-                                return
-                        if frequencyCol == 0:
-                            print colored("[ERROR]", 'red')+ " Column %s not found in specified table(s)" % col
-                            return
-                elif indexDot != -1:
-                    colTable = queryConditions[i][j][:indexDot]
-                    colName = queryConditions[i][j][indexDot + 1: ]
-                    flag = 0
-                    for table in tables:
-                        if colTable.lower() == table.lower():
-                            if colName in databases[table.lower()]:
-                                temp.append([table, colName])
-                                flag = 1
-                            break
-                    if not flag:
-                        print colored("[ERROR]", 'red')+ " Column %s not found in specified table(s)" % queryConditions[i][j]
-                        return
-                if j == 2:
-                    conditions.append(temp)
-    return conditions, conjunction
-
-def recursiveJoinProduct(joinProduct, resultTable, level, templists):
-    if level == 1:
-        for i in resultTable[len(resultTable) - level]:
-            templists.extend(i)
-            temp = templists[:]
-            joinProduct.append(temp)
-            for j in i:
-                templists.pop()
-        return joinProduct, templists
-
-    for i in resultTable[len(resultTable) - level]:
-        templists.extend(i)
-        joinProduct, templists = recursiveJoinProduct(joinProduct, resultTable, level - 1, templists)
-        for j in i:
-            templists.pop()
-    return joinProduct, templists
-
-def printTable(queryList, resultArr, origQueryList, conditions):
-    tableSet = set()
-    for entry in queryList:
-        tableSet.add(entry[0])
-    finalrows = []
-    for i in tableSet:
-        finalrows.append([i, set(range(0,1000))])
-    finalrows.sort()
-
-    for entry, colList in zip(queryList, resultArr):
-        tableSet = set([m[1] for m in colList])
-        for j in range(len(finalrows)):
-            if finalrows[j][0] == entry[0]:
-                finalrows[j][1] = finalrows[j][1] & tableSet
-
-    for entry in finalrows:
-        entry[1] = list(entry[1])
-        entry[1].sort()
-
-    resultTable = []
-    i = -1
-    for entry in finalrows:
-        i += 1
-        curcol = entry[1]
-        resultTable.append([])
-        for j in curcol:
-            resultTable[i].append([])
-
-    # print resultTable
-    noConditionFlag = True
-    for i in range(len(conditions)):
-        if len(conditions[i][0]) == 2 and len(conditions[i][1]) == 2:
-            noConditionFlag = False
+                links = linksTo(joinConditions, table, order)
+                estimate = float(estimates[-1]) * sizes[table]
+                for link in links:
+                    estimate *= joinSelectivity(link)
+                candidates.append((not links, estimate, position, table))
+            unlinked, estimate, position, table = min(candidates)
+            order.append(table)
+            estimates.append(estimate)
+        if best is None or sum(estimates[1:]) < best[0]:
+            best = (sum(estimates[1:]), order, estimates)
+    return best[1], best[2]
+
+def joinTables(tables, rowList, joinConditions, residual, limited=False):
+    # scan -> join -> filter part of the pipeline. Returns the order of the FROM tables in the
+    # output tuples and a lazy stream of row id tuples, one id per table. Joins of three or more
+    # tables run in the order chosen by planJoinOrder. limited is set when only the first rows of
+    # the stream will be read
+    order = []
+    stream = None
+    pending = list(joinConditions)
+    estimates = None
+    if len(tables) > 2 and joinConditions:
+        tables, estimates = planJoinOrder(tables, rowList, joinConditions)
+    for table in tables:
+        rows = rowsForTable(table, rowList)
+        size = tableLength(table)
+        if not order:
+            stream = ((row,) for row in iterRows(rows, size))
+            order.append(table)
+            continue
+
+        links = [c for c in pending if (c[0][0] == table and c[1][0] in order) or (c[1][0] == table and c[0][0] in order)]
+        if not links:
+            stream = crossJoin(stream, rows, size)
+            order.append(table)
+            continue
+
+        links.sort(key=lambda c: c[2] != '=')
+        for link in links:
+            pending.remove(link)
+        link = links[0]
+        if link[1][0] == table:
+            probe, build, operatorName = link[0], link[1], link[2]
+        else:
+            probe, build, operatorName = link[1], link[0], MIRRORED_OPERATORS[link[2]]
+        if len(order) == 1:
+            stream = joinPair(probe, build, operatorName, rowsForTable(order[0], rowList), rows, limited)
+        else:
+            buildIndex = tableIndex(build)
+            method = joinMethod(operatorName, build, buildIndex, estimates[len(order) - 1],
+                                size if rows is None else len(rows))
+            stream = probeJoin(stream, order.index(probe[0]), tableColumn(probe), tableColumn(build), rows,
+                               operatorName, method, buildIndex)
+        order.append(table)
+        if len(links) > 1:
+            stream = filterStream(stream, ['and', links[1:]], order)
+
+    if residual:
+        stream = filterStream(stream, buildComparisons(residual, 'and'), order)
+    return order, stream
+
+def solveCondition(condition):
+    # rows of a table matching a comparison on its columns
+    operatorName = condition[2]
+    column = tableColumn(condition[0])
+    if len(condition[1]) == 1:
+        value = int(condition[1][0])
+        # a selective enough indexed predicate is answered by the index instead of a scan
+        columnIndex = tableIndex(condition[0])
+        if columnIndex is not None and columnIndex.supports(operatorName) and \
+                columnIndex.count(operatorName, value) <= INDEX_SELECTIVITY * len(column):
+            return RowSet.fromRows(len(column), columnIndex.match(operatorName, value))
+        return column.compare(operatorName, value)
+    return column.compare(operatorName, tableColumn(condition[1]))
+
+def conditionSelectivity(condition):
+    # estimated fraction of rows passing a comparison: exact from an index, 1 / distinct values for
+    # equality, or interpolated between the column's min and max for ranges
+    if len(condition[1]) == 2:
+        if condition[0][0] != condition[1][0]:
+            return joinSelectivity(condition)
+        return THETA_JOIN_SELECTIVITY
+    column = tableColumn(condition[0])
+    if not len(column):
+        return 0.0
+    operatorName, value = condition[2], int(condition[1][0])
+    columnIndex = tableIndex(condition[0])
+    if columnIndex is not None and columnIndex.supports(operatorName):
+        return float(columnIndex.count(operatorName, value)) / len(column)
+    if operatorName in ('=', '!='):
+        equal = 1.0 / max(1, column.distinctCount())
+        return equal if operatorName == '=' else 1 - equal
+    bounds = column.bounds()
+    if bounds is None:
+        return 0.0
+    low, high = bounds
+    below = min(1.0, max(0.0, float(value - low) / (high - low + 1)))
+    return below if operatorName in ('<', '<=') else 1 - below
+
+def expressionSelectivity(node):
+    if not isConnective(node):
+        return conditionSelectivity(node)
+    selectivities = [expressionSelectivity(child) for child in node[1]]
+    if node[0] == 'and':
+        return reduce(operator.mul, selectivities, 1.0)
+    return 1 - reduce(operator.mul, [1 - selectivity for selectivity in selectivities], 1.0)
+
+def evaluateFilter(node, candidates):
+    # rows of one table passing an expression over its columns, out of candidates (None for all
+    # rows). AND runs its most selective operand first and only checks the rows still passing,
+    # OR runs its least selective operand first and only checks the rows not matched yet; both
+    # stop once nothing is left to check
+    if not isConnective(node):
+        size = tableLength(node[0][0])
+        if candidates is not None and len(candidates) < ROW_CHECK_FRACTION * size:
+            test = compileCondition(node, {node[0][0]: 0})
+            return RowSet.fromRows(size, [row for row in candidates if test((row,))])
+        rows = solveCondition(node)
+        return rows if candidates is None else rows & candidates
+    children = sorted(node[1], key=expressionSelectivity, reverse=node[0] == 'or')
+    if node[0] == 'and':
+        for child in children:
+            candidates = evaluateFilter(child, candidates)
+            if not candidates:
+                break
+        return candidates
+    size = tableLength(next(iterComparisons(node))[0][0])
+    total = size if candidates is None else len(candidates)
+    matched = None
+    remaining = candidates
+    for child in children:
+        rows = evaluateFilter(child, remaining)
+        matched = rows if matched is None else matched | rows
+        if len(matched) == total:
             break
+        # narrowing the rows left to check only pays off once they are few enough to be
+        # checked one by one
+        if total - len(matched) < ROW_CHECK_FRACTION * size:
+            remaining = (RowSet.all(size) if candidates is None else candidates) - matched
+    return matched
 
-    i = -1
-    for entry in finalrows:
-        i += 1
-        for queryEntry, resultEntry in zip(queryList, resultArr):
-            if queryEntry[0] == entry[0]:
-                temporaryList = resultEntry
-                for tempEntry in temporaryList:
-                    if tempEntry[1] in entry[1]:
-                        resultTable[i][entry[1].index(tempEntry[1])].append(tempEntry[0])
-
-    joinProduct = []
-    header = []
-    for entry in origQueryList:
-        if len(entry) == 3:
-            tempheader = entry[2] + '(' + entry[0] + '.' + entry[1] + ')'
-            header.append(tempheader)
+def selectivityOrder(node):
+    # the expression with its AND operands in increasing and its OR operands in decreasing order of
+    # selectivity, the order evaluateFilter runs them in
+    if not isConnective(node):
+        return node
+    children = [selectivityOrder(child) for child in node[1]]
+    return [node[0], sorted(children, key=expressionSelectivity, reverse=node[0] == 'or')]
+
+def filterMorsel(task):
+    # mask of the rows [start, end) of one table passing an expression over its columns. Runs in
+    # the scan workers: AND stops once no row of the morsel is left, OR once all of them match
+    node, start, end = task
+    return str(morselRows(node, start, end).mask)
+
+def morselRows(node, start, end):
+    if not isConnective(node):
+        column = tableColumn(node[0])
+        other = int(node[1][0]) if len(node[1]) == 1 else tableColumn(node[1])
+        return column.compare(node[2], other, start, end)
+    rows = None
+    for child in node[1]:
+        childRows = morselRows(child, start, end)
+        if rows is None:
+            rows = childRows
+        elif node[0] == 'and':
+            rows = rows & childRows
         else:
-            header.append(entry[0] + '.' + entry[1])
-    joinProduct.append(header)
+            rows = rows | childRows
+        if (node[0] == 'and' and not rows) or (node[0] == 'or' and len(rows) == end - start):
+            break
+    return rows
+
+def parallelFilter(node):
+    # the fused filter of one table scanned morsel by morsel on the scan pool, or None when the
+    # table is scanned serially: it is small, or an index answers one of its comparisons
+    morsels = scanPool.morsels(tableLength(next(iterComparisons(node))[0][0]))
+    if morsels is None or any(len(condition[1]) == 1 and tableIndex(condition[0]) is not None
+                              for condition in iterComparisons(node)):
+        return None
+    node = selectivityOrder(node)
+    return RowSet(bytearray(''.join(scanPool.map(filterMorsel, [(node, start, end) for start, end in morsels]))))
+
+def pushDownConditions(expression):
+    # logical plan step: splits the WHERE clause into the row filters of each table's scan, join
+    # conditions between two tables, and residual conditions that are checked per result row.
+    # Only the top level conjuncts can be split; an OR spanning several tables stays residual
+    scans = OrderedDict()
+    joinConditions = []
+    residual = []
+    if expression is None:
+        return scans, joinConditions, residual
+    for node in (expression[1] if expression[0] == 'and' else [expression]):
+        tables = expressionTables(node)
+        if not isConnective(node) and isJoinCondition(node):
+            joinConditions.append(node)
+        elif len(tables) == 1:
+            scans.setdefault(tables.pop(), []).append(node)
+        else:
+            residual.append(node)
+    return scans, joinConditions, residual
+
+def scanColumns(tableQueryList, *expressions):
+    # logical plan step: the columns each table's scan has to read, i.e. the ones used by SELECT,
+    # GROUP BY, WHERE, HAVING and the join keys. Other columns of the table are never copied out
+    # of its file
+    columns = OrderedDict()
+    for entry in tableQueryList:
+        columns.setdefault(entry[0].lower(), set())
+        if entry[1] != '*':
+            columns[entry[0].lower()].add(entry[1])
+    for expression in expressions:
+        for condition in iterComparisons(expression):
+            for side in condition[:2]:
+                if len(side) > 1 and side[1] != '*':
+                    columns.setdefault(side[0].lower(), set()).add(side[1])
+    return columns
+
+def solveWithConditions(scans):
+    # runs the pushed-down filters of every table scan as one fused evaluation per table, split
+    # into morsels on the scan pool for big tables
+    rowList = []
+    for table, filters in scans.iteritems():
+        node = buildComparisons(filters, 'and')
+        rows = parallelFilter(node)
+        rowList.append([table, evaluateFilter(node, None) if rows is None else rows])
+    return rowList
+
+def sortDistinct(keyedRows):
+    # external sort-based distinct: sorted runs of at most DISTINCT_RUN_LENGTH entries, and no
+    # more than the budget holds, are spilled to temporary files and merged, keeping the first
+    # occurrence of every key. Those
+    # go through a second set of runs sorted by position, whose merge yields them lazily in
+    # input order, so no more than a run is held in memory
+    length = max(1, min(DISTINCT_RUN_LENGTH, DISTINCT_MEMORY_BUDGET // DISTINCT_ENTRY_BYTES))
+    keyRuns, positionRuns = [], []
+    try:
+        for run in iterRuns(enumerate(keyedRows), length):
+            keyRuns.append(spillRun(sorted((key, position, rowId) for position, (key, rowId) in run)))
+            run = None
+
+        firsts = firstOccurrences(heapq.merge(*map(iterPickled, keyRuns)))
+        for run in iterRuns(firsts, length):
+            positionRuns.append(spillRun(sorted(run)))
+            run = None
+        for position, key, rowId in heapq.merge(*map(iterPickled, positionRuns)):
+            yield key, rowId
+    finally:
+        for spilled in keyRuns + positionRuns:
+            spilled.close()
+
+def firstOccurrences(entries):
+    # (position, key, rowId) of the first entry of every key among (key, position, rowId)
+    # entries sorted by key and position
+    lastKey = None
+    first = True
+    for key, position, rowId in entries:
+        if first or key != lastKey:
+            yield position, key, rowId
+            lastKey = key
+            first = False
+
+def spillRun(entries):
+    # writes sorted entries to a temporary file, rewound for reading them back with iterPickled
+    runFile = tempfile.TemporaryFile()
+    for entry in entries:
+        cPickle.dump(entry, runFile, cPickle.HIGHEST_PROTOCOL)
+    runFile.seek(0)
+    return runFile
+
+def iterRuns(iterable, length):
+    iterator = iter(iterable)
+    while True:
+        run = list(islice(iterator, length))
+        if not run:
+            return
+        yield run
+        run = None
+
+def iterPickled(runFile):
+    while True:
+        try:
+            yield cPickle.load(runFile)
+        except EOFError:
+            return
+
+def drainList(items):
+    # yields the items of a list in order, removing each from the list
+    items.reverse()
+    while items:
+        yield items.pop()
+
+def hashDistinct(keyedRows):
+    # one-pass hash distinct over (key, rowId) pairs, keeping the first occurrence of every key
+    # in input order; switches to sortDistinct once the hash set outgrows DISTINCT_MEMORY_BUDGET
+    limit = max(1, DISTINCT_MEMORY_BUDGET // DISTINCT_ENTRY_BYTES)
+    seen = set()
+    result = []
+    iterator = iter(keyedRows)
+    for key, rowId in iterator:
+        if key not in seen:
+            if len(seen) >= limit:
+                # the entries so far are dropped as the sort spills them
+                entries = chain(drainList(result), [(key, rowId)], iterator)
+                seen = result = None
+                return sortDistinct(entries)
+            seen.add(key)
+            result.append((key, rowId))
+    return result
+
+def gatherValues(column, rows, source=None):
+    # masked gather: packs the non-NULL values of the selected rows into one buffer, or the
+    # entries of source (one per row of the column) at those rows
+    source = column.values if source is None else source
+    if column.hasNulls():
+        if rows is None:
+            mask = imap(operator.not_, column.nulls)
+        else:
+            mask = imap(operator.gt, rows.mask, column.nulls)
+    elif rows is None:
+        return source
+    else:
+        mask = rows.mask
+    return list(compress(source, mask))
 
-    if noConditionFlag:
-        joinProduct, templists = recursiveJoinProduct(joinProduct, resultTable, len(resultTable), [])
+def computeAggregates(column, rows, functions, partial=None, weights=1):
+    # every aggregate requested on one column shares a single gather of its selected values,
+    # after which each reduction is a C-level pass over the packed buffer. partial is the
+    # (count, sum, min, max) already merged from the scan workers, if any. Over a join, weights
+    # is the number of joined rows every selected row is part of: one number for all of them,
+    # or an array with one count per row of the table (then partial is None)
+    if partial is None:
+        values = gatherValues(column, rows)
+        count, total = len(values), None
     else:
-        for i in resultTable[0]:
-            joinProduct.append([])
-        for i in resultTable:
-            for j in range(len(i)):
-                for k in i[j]:
-                    joinProduct[j+1].append(k)
-
-    if len(conditions) > 0:
-        if len(conditions) > 1:
-            if len(conditions[0][0]) == 2 and len(conditions[0][1]) == 2:
-                if len(conditions[1][0]) == 2 and len(conditions[1][1]) == 2:
-                    columnNames = []
-                    for i in conditions[0]:
-                        for j in conditions[1]:
-                            if i == j:
-                                colName = str(i[0]) + '.' + str(i[1])
-                                columnNames.append(colName)
-                    try:
-                        for columnName in columnNames:
-                            tempIndex = joinProduct[0].index(columnName)
-                            for row in joinProduct:
-                                del row[tempIndex]
-                    except:
-                        pass
+        count, total, low, high = partial
+    if isinstance(weights, array):
+        counts = gatherValues(column, rows, weights)
+        count, total = sum(counts), sum(imap(operator.mul, values, counts))
+    elif weights != 1:
+        count, total = count * weights, (sum(values) if total is None else total) * weights
+    results = {}
+    for function in functions:
+        if function == 'count':
+            results[function] = count
+        elif not count:
+            results[function] = "NULL"
+        elif function == 'sum':
+            total = sum(values) if total is None else total
+            results[function] = total
+        elif function == 'avg' or function == 'average':
+            total = sum(values) if total is None else total
+            results[function] = total / float(count)
+        elif function == 'min':
+            results[function] = min(values) if partial is None else low
+        elif function == 'max':
+            results[function] = max(values) if partial is None else high
+    return results
+
+def aggregateMorsel(task):
+    # (count, sum, min, max) of the non-NULL selected values among the rows [start, end) of a
+    # column; runs in the scan workers
+    side, start, end, mask = task
+    values, nulls = tableColumn(side).block(start, end)
+    if mask is not None:
+        values = list(compress(values, imap(operator.gt, bytearray(mask), nulls)))
+    elif '\x01' in nulls:
+        values = list(compress(values, imap(operator.not_, nulls)))
+    if not len(values):
+        return 0, 0, None, None
+    return len(values), sum(values), min(values), max(values)
+
+def parallelAggregates(side, rows):
+    # the partial aggregates of every morsel of a column merged, or None when it is scanned serially
+    morsels = scanPool.morsels(tableLength(side[0]))
+    if morsels is None:
+        return None
+    tasks = [(side, start, end, None if rows is None else str(rows.mask[start:end])) for start, end in morsels]
+    partials = [partial for partial in scanPool.map(aggregateMorsel, tasks) if partial[0]]
+    if not partials:
+        return 0, 0, None, None
+    counts, totals, lows, highs = zip(*partials)
+    return sum(counts), sum(totals), min(lows), max(highs)
+
+def solveAggregates(querylist, rowList, joined=None, weights=None):
+    # groups the aggregate entries of the query by column so each column is scanned once. Over
+    # several tables count(*) counts the joined rows, and the other aggregates count every row
+    # once per joined row it is part of, as given by weights
+    requested = OrderedDict()
+    for entry in querylist:
+        if len(entry) == 3 and entry[2].lower() in AGGREGATE_FUNCTIONS:
+            requested.setdefault((entry[0], entry[1]), set()).add(entry[2].lower())
+
+    aggregates = {}
+    for (tableName, colName), functions in requested.iteritems():
+        rows = rowsForTable(tableName, rowList)
+        if colName == '*':
+            rowCount = joined
+            if rowCount is None:
+                rowCount = tableLength(tableName) if rows is None else len(rows)
+            aggregates[(tableName, colName)] = {'count': rowCount}
+        else:
+            column = databases[tableName.lower()][colName]
+            weight = weights[tableName] if weights else 1
+            partial = None if isinstance(weight, array) else parallelAggregates((tableName, colName), rows)
+            aggregates[(tableName, colName)] = computeAggregates(column, rows, functions, partial, weight)
+    return aggregates
+
+def distinctMorsel(task):
+    # first selected row of every value among the rows [start, end) of a column, as (value, row)
+    # pairs; runs in the scan workers
+    side, start, end, mask = task
+    values, nulls = tableColumn(side).block(start, end)
+    rows = xrange(end - start) if mask is None else compress(xrange(end - start), bytearray(mask))
+    return list(hashDistinct(("NULL" if nulls[row] else values[row], start + row) for row in rows))
+
+def parallelDistinct(side, rows):
+    # first selected row of every value of a column, from per-morsel hash tables merged in row
+    # order, or None when the column is scanned serially or has too many values for it
+    column = tableColumn(side)
+    morsels = scanPool.morsels(len(column))
+    if morsels is None or column.distinctCount() > PARALLEL_GROUP_LIMIT:
+        return None
+    tasks = [(side, start, end, None if rows is None else str(rows.mask[start:end])) for start, end in morsels]
+    return hashDistinct(chain.from_iterable(scanPool.map(distinctMorsel, tasks)))
+
+def restrictDistinctColumns(queryList, rowList):
+    # distinct(col) keeps only the first selected row of every value of col
+    for entry in queryList:
+        if len(entry) == 3 and entry[2].lower() == 'distinct':
+            column = tableColumn(entry)
+            rows = rowsForTable(entry[0], rowList)
+            firsts = parallelDistinct(entry, rows)
+            if firsts is None:
+                firsts = hashDistinct((column[l], l) for l in iterRows(rows, len(column)))
+            distinctRows = RowSet.fromRows(len(column), [l for x, l in firsts])
+            for row in rowList:
+                if row[0] == entry[0]:
+                    row[1] = distinctRows
+                    break
+            else:
+                rowList.append([entry[0], distinctRows])
+
+def participatingRows(order, stream):
+    # per-table RowSets of the rows that take part in at least one joined result row, the number
+    # of joined rows, and per table the number of joined rows every one of its rows is part of
+    weights = [array('l', [0]) * tableLength(table) for table in order]
+    joined = 0
+    for combo in stream:
+        joined += 1
+        for counts, row in izip(weights, combo):
+            counts[row] += 1
+    rowList = [[table, RowSet(bytearray(imap(bool, counts)))] for table, counts in izip(order, weights)]
+    return rowList, joined, dict(izip(order, weights))
+
+def crossJoinWeights(order, rowList):
+    # number of rows of the cross join of the selected rows of every table, and per table the
+    # number of joined rows each of its selected rows is part of
+    sizes = []
+    for table in order:
+        rows = rowsForTable(table, rowList)
+        sizes.append(tableLength(table) if rows is None else len(rows))
+    joined = reduce(operator.mul, sizes, 1)
+    return joined, dict((table, joined // size if size else 0) for table, size in izip(order, sizes))
+
+def isAggregateQuery(queryList):
+    return any(len(entry) == 3 and entry[2].lower() in AGGREGATE_FUNCTIONS for entry in queryList)
+
+def aggregateRow(queryList, rowList, joined=None, weights=None):
+    aggregates = solveAggregates(queryList, rowList, joined, weights)
+    row = []
+    for entry in queryList:
+        if len(entry) == 3 and entry[2].lower() in AGGREGATE_FUNCTIONS:
+            row.append(aggregates[(entry[0], entry[1])][entry[2].lower()])
+        else:
+            # a plain column next to aggregates shows the value of the first selected row
+            column = tableColumn(entry)
+            first = next(iter(iterRows(rowsForTable(entry[0], rowList), len(column))), None)
+            row.append("NULL" if first is None else column[first])
+    return row
+
+def groupEntries(queryList, having):
+    # what GROUP BY has to keep per group: the aggregated columns, each with the functions asked
+    # for on it, and the plain columns, which show their value in the group's first row
+    aggregated = OrderedDict()
+    plain = []
+    sides = [entry for entry in queryList if len(entry) == 2 or entry[2].lower() in AGGREGATE_FUNCTIONS]
+    for condition in iterComparisons(having):
+        sides.extend(side for side in condition[:2] if len(side) > 1)
+    for entry in sides:
+        if len(entry) == 2:
+            if tuple(entry) not in plain:
+                plain.append(tuple(entry))
+        elif entry[1] != '*':
+            aggregated.setdefault((entry[0], entry[1]), set()).add(entry[2].lower())
+    return aggregated.keys(), plain
+
+def gatherRecordColumn(column, rows, start=0, end=None):
+    # values of the selected rows of a column, or of its rows [start, end) with rows selecting
+    # among those, with NULL as None
+    values, nulls = (column.values, column.nulls) if end is None else column.block(start, end)
+    hasNulls = '\x01' in nulls
+    if rows is not None:
+        values, nulls = compress(values, rows.mask), compress(nulls, rows.mask)
+    if not hasNulls:
+        return values
+    return [None if isNull else value for value, isNull in izip(values, nulls)]
+
+def tableRecords(table, rows, grouping, columns, start=0, end=None):
+    # groupRecords of one table, read column by column
+    keys = izip(*[gatherRecordColumn(tableColumn(side), rows, start, end) for side in grouping])
+    values = izip(*[gatherRecordColumn(tableColumn(side), rows, start, end) for side in columns])
+    if not grouping:
+        keys = repeat(())
+    if not columns:
+        values = repeat((), len(rows) if rows is not None else (tableLength(table) if end is None else end) - start)
+    return izip(keys, values)
+
+def groupRecords(order, stream, rowList, grouping, columns):
+    # (key, values) per joined row: the GROUP BY values and those of the columns the groups
+    # need, with NULL as None. A single table is read column by column instead of per row id
+    if len(order) == 1:
+        return tableRecords(order[0], rowsForTable(order[0], rowList), grouping, columns)
+    keyColumns = [(order.index(side[0]), tableColumn(side)) for side in grouping]
+    valueColumns = [(order.index(side[0]), tableColumn(side)) for side in columns]
+
+    def fetch(combo, columns):
+        return tuple(None if column.nulls[combo[position]] else column.values[combo[position]]
+                     for position, column in columns)
+    return ((fetch(combo, keyColumns), fetch(combo, valueColumns)) for combo in stream)
+
+def hashAggregate(records, aggregatedCount, level=0):
+    # one-pass hash aggregation of (key, values) records into (key, state) groups, where a state is
+    # [rows, first values of the plain columns, then count, sum, min and max of every aggregated
+    # column]. Once the hash table holds GROUP_MEMORY_BUDGET worth of groups, records of new
+    # groups are spilled to GROUP_SPILL_PARTITIONS temporary files by hash of their key; every file
+    # is aggregated on its own after the groups in memory are done, spilling again (with another
+    # hash) if need be
+    limit = max(1, GROUP_MEMORY_BUDGET // GROUP_ENTRY_BYTES)
+    groups = {}
+    partitions = None
+    bases = range(2, 2 + 4 * aggregatedCount, 4)
+    # the group states are never cyclic; collecting while millions of them are created or
+    # handed out would rescan them over and over
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        for key, values in records:
+            state = groups.get(key)
+            if state is None:
+                if len(groups) >= limit:
+                    if partitions is None:
+                        partitions = [tempfile.TemporaryFile() for i in range(GROUP_SPILL_PARTITIONS)]
+                    partition = partitions[hash((level, key)) % GROUP_SPILL_PARTITIONS]
+                    cPickle.dump((key, values), partition, cPickle.HIGHEST_PROTOCOL)
+                    continue
+                state = groups[key] = [0, values[aggregatedCount:]] + [0, 0, None, None] * aggregatedCount
+            state[0] += 1
+            for base, value in izip(bases, values):
+                if value is None:
+                    continue
+                if state[base]:
+                    state[base] += 1
+                    state[base + 1] += value
+                    if value < state[base + 2]:
+                        state[base + 2] = value
+                    elif value > state[base + 3]:
+                        state[base + 3] = value
                 else:
-                    colName = str(conditions[0][1][0]) + '.' + str(conditions[0][1][1])
-                    firstcolName = str(conditions[0][0][0]) + '.' + str(conditions[0][0][1])
-                    try:
-                        if conditions[0][0] in queryList:
-                            tempIndex = joinProduct[0].index(colName)
-                            for row in joinProduct:
-                                del row[tempIndex]
-
-                        elif conditions[0][1] in queryList and conditions[0][0] not in queryList:
-                            tempIndex = joinProduct[0].index(firstcolName)
-                            for row in joinProduct:
-                                del row[tempIndex]
-                    except:
-                        pass
-            elif len(conditions[1][0]) == 2 and len(conditions[1][1]) == 2:
-                colName = str(conditions[1][1][0]) + '.' + str(conditions[1][1][1])
-                firstcolName = str(conditions[1][0][0]) + '.' + str(conditions[1][0][1])
-                try:
-                    if conditions[1][0] in queryList:
-                        tempIndex = joinProduct[0].index(colName)
-                        for row in joinProduct:
-                            del row[tempIndex]
-
-                    elif conditions[1][1] in queryList and conditions[1][0] not in queryList:
-                        tempIndex = joinProduct[0].index(firstcolName)
-                        for row in joinProduct:
-                            del row[tempIndex]
-                except:
-                    pass
-        elif len(conditions) == 1:
-            if len(conditions[0][0]) == 2 and len(conditions[0][1]) == 2:
-                colName = str(conditions[0][1][0]) + '.' + str(conditions[0][1][1])
-                firstcolName = str(conditions[0][0][0]) + '.' + str(conditions[0][0][1])
-                try:
-                    if conditions[0][0] in queryList:
-                        tempIndex = joinProduct[0].index(colName)
-                        for row in joinProduct:
-                            del row[tempIndex]
-
-                    elif conditions[0][1] in queryList and conditions[0][0] not in queryList:
-                        tempIndex = joinProduct[0].index(firstcolName)
-                        for row in joinProduct:
-                            del row[tempIndex]
-                except:
-                    pass
-
-        newJoinProduct = []
-        for i in range(len(joinProduct)):
-            if len(joinProduct[i]) < len(joinProduct[0]):
-                pass
+                    state[base:base + 4] = [1, value, value, value]
+        for group in groups.iteritems():
+            yield group
+        groups = None
+        for partition in partitions or []:
+            partition.seek(0)
+            for group in hashAggregate(iterPickled(partition), aggregatedCount, level + 1):
+                yield group
+    finally:
+        if collecting:
+            gc.enable()
+        for partition in partitions or []:
+            partition.close()
+
+def groupGetter(entry, aggregated, plain):
+    # a function reading the value of a select list or HAVING entry from a group state
+    if len(entry) == 1:
+        value = int(entry[0])
+        return lambda state: value
+    if len(entry) == 2:
+        position = plain.index(tuple(entry))
+        return lambda state: state[1][position]
+    function = AGGREGATE_ALIASES.get(entry[2].lower(), entry[2].lower())
+    if entry[1] == '*':
+        return operator.itemgetter(0)
+    base = 2 + 4 * aggregated.index((entry[0], entry[1]))
+    if function == 'count':
+        return operator.itemgetter(base)
+    if function == 'avg':
+        return lambda state: state[base + 1] / float(state[base]) if state[base] else "NULL"
+    offset = {'sum': 1, 'min': 2, 'max': 3}[function]
+    return lambda state: state[base + offset] if state[base] else "NULL"
+
+def compileHaving(node, aggregated, plain):
+    # a test on group states for a HAVING expression
+    if isConnective(node):
+        tests = [compileHaving(child, aggregated, plain) for child in node[1]]
+        combine = all if node[0] == 'and' else any
+        return lambda state: combine(test(state) for test in tests)
+    left, right = [groupGetter(side, aggregated, plain) for side in node[:2]]
+    function = OPERATORS[node[2]]
+
+    def test(state):
+        leftValue, rightValue = left(state), right(state)
+        if leftValue is None or rightValue is None or leftValue == "NULL" or rightValue == "NULL":
+            return False
+        return function(leftValue, rightValue)
+    return test
+
+def groupMorsel(task):
+    # hash aggregated (key, state) groups of the rows [start, end) of one table; runs in the
+    # scan workers
+    table, grouping, columns, aggregatedCount, start, end, mask = task
+    rows = None if mask is None else RowSet(bytearray(mask))
+    return list(hashAggregate(tableRecords(table, rows, grouping, columns, start, end), aggregatedCount))
+
+def mergeGroups(partials, aggregatedCount):
+    # combines the groups of every morsel, in row order so each group keeps its first row's values
+    groups = {}
+    bases = range(2, 2 + 4 * aggregatedCount, 4)
+    for key, state in chain.from_iterable(partials):
+        merged = groups.get(key)
+        if merged is None:
+            groups[key] = state
+            continue
+        merged[0] += state[0]
+        for base in bases:
+            if not state[base]:
+                continue
+            if not merged[base]:
+                merged[base:base + 4] = state[base:base + 4]
+                continue
+            merged[base] += state[base]
+            merged[base + 1] += state[base + 1]
+            merged[base + 2] = min(merged[base + 2], state[base + 2])
+            merged[base + 3] = max(merged[base + 3], state[base + 3])
+    return groups.iteritems()
+
+def parallelGroups(order, rowList, grouping, columns, aggregatedCount):
+    # GROUP BY of a single table as partial hash aggregates per morsel on the scan pool, or None
+    # when it runs serially: joins, small tables, or more groups expected than PARALLEL_GROUP_LIMIT
+    if len(order) != 1:
+        return None
+    morsels = scanPool.morsels(tableLength(order[0]))
+    if morsels is None or reduce(operator.mul, [tableColumn(side).distinctCount() + 1 for side in grouping], 1) > \
+            PARALLEL_GROUP_LIMIT:
+        return None
+    rows = rowsForTable(order[0], rowList)
+    tasks = [(order[0], grouping, columns, aggregatedCount, start, end,
+              None if rows is None else str(rows.mask[start:end])) for start, end in morsels]
+    return mergeGroups(scanPool.map(groupMorsel, tasks), aggregatedCount)
+
+def groupRows(queryList, order, stream, rowList, grouping, having):
+    # GROUP BY: hash aggregates the joined rows by the grouping columns and yields one output row
+    # per group passing HAVING
+    aggregated, plain = groupEntries(queryList, having)
+    groups = parallelGroups(order, rowList, grouping, aggregated + plain, len(aggregated))
+    if groups is None:
+        groups = hashAggregate(groupRecords(order, stream, rowList, grouping, aggregated + plain), len(aggregated))
+    keep = compileHaving(having, aggregated, plain) if having is not None else None
+    getters = [groupGetter(entry, aggregated, plain) for entry in queryList]
+    for key, state in groups:
+        if keep is not None and not keep(state):
+            continue
+        row = [getter(state) for getter in getters]
+        yield ["NULL" if value is None else value for value in row]
+
+def projectColumns(queryList, joinConditions):
+    # select * over an equi-join shows the join column once: the second side is dropped
+    projected = [(entry[0], entry[1]) for entry in queryList]
+    dropped = set()
+    for condition in joinConditions:
+        if condition[2] == '=' and tuple(condition[0]) in projected and tuple(condition[1]) in projected:
+            dropped.add(tuple(condition[1]))
+    return [entry for entry in queryList if (entry[0], entry[1]) not in dropped]
+
+def entryKey(entry):
+    if len(entry) == 2:
+        return tuple(entry)
+    return (entry[0], entry[1], AGGREGATE_ALIASES.get(entry[2].lower(), entry[2].lower()))
+
+def orderEntries(queryList, ordering):
+    # the output columns extended by the ORDER BY keys that are not selected (they are dropped
+    # again after sorting), and (position, descending) of every key in those rows
+    entries = list(queryList)
+    keys = []
+    for side, descending in ordering:
+        positions = [i for i, entry in enumerate(entries) if entryKey(entry) == entryKey(side)]
+        if not positions:
+            entries.append(side)
+            positions = [len(entries) - 1]
+        keys.append((positions[0], descending))
+    return entries, keys
+
+def sortKey(keys):
+    # ascending key for output rows ordered by (position, descending) keys: NULL sorts first, or
+    # last when descending
+    def key(row):
+        parts = []
+        for position, descending in keys:
+            value = row[position]
+            if value == "NULL":
+                parts.append((1, 0) if descending else (0, 0))
             else:
-                newJoinProduct.append(joinProduct[i])
-        joinProduct = newJoinProduct[:]
+                parts.append((0, -value) if descending else (1, value))
+        return parts
+    return key
+
+def comboSortKey(order, ordering):
+    # (key, reverse) ordering row id tuples straight from the columns, so that only the rows
+    # shown have to be projected. A single key without NULLs is read as is
+    parts = [(order.index(side[0]), tableColumn(side).values, tableColumn(side).nulls, descending)
+             for side, descending in ordering]
+    if len(parts) == 1 and '\x01' not in parts[0][2]:
+        position, values, nulls, descending = parts[0]
+        return (lambda combo: values[combo[position]]), descending
 
-    table = []
-    if len(joinProduct) != 1:
-        table = AsciiTable(joinProduct)
-        print table.table
+    def key(combo):
+        result = []
+        for position, values, nulls, descending in parts:
+            row = combo[position]
+            if nulls[row]:
+                result.append((1, 0) if descending else (0, 0))
+            else:
+                result.append((0, -values[row]) if descending else (1, values[row]))
+        return result
+    return key, False
+
+def limitRows(rows, limit, key=None, reverse=False):
+    # ORDER BY (when key is given) and LIMIT/OFFSET. An ordered LIMIT keeps a bounded heap of
+    # count + offset rows (top-K) instead of sorting everything, and an unordered one stops
+    # pulling rows from the scan/join pipeline once it has enough
+    count = limit[0] if limit else None
+    offset = limit[1] if len(limit) > 1 else 0
+    if key is not None:
+        if count is not None:
+            rows = (heapq.nlargest if reverse else heapq.nsmallest)(count + offset, rows, key=key)
+        else:
+            rows = sorted(rows, key=key, reverse=reverse)
+    if count is not None:
+        rows = islice(rows, offset, offset + count)
+    return rows
+
+def projectRows(queryList, order, stream, few=False):
+    # output rows of the row id tuples; few rows (a LIMIT) are read from the columns in place
+    # rather than copying whole columns out of their files
+    projection = [(order.index(entry[0]), tableColumn(entry)) for entry in queryList]
+    if few:
+        projection = [(position, column.cell) for position, column in projection]
     else:
+        projection = [(position, column.__getitem__) for position, column in projection]
+    for combo in stream:
+        yield tuple(read(combo[position]) for position, read in projection)
+
+def tableHeader(queryList):
+    header = []
+    for entry in queryList:
+        if len(entry) == 3:
+            header.append(entry[2] + '(' + entry[0] + '.' + entry[1] + ')')
+        else:
+            header.append(entry[0] + '.' + entry[1])
+    return header
+
+def columnWidths(queryList, header):
+    # widest possible cell of every output column, known before any row is produced
+    widths = []
+    for name, entry in izip(header, queryList):
+        column = tableColumn(entry)
+        width = len(name)
+        bounds = column.bounds()
+        if bounds is not None:
+            width = max(width, len(str(bounds[0])), len(str(bounds[1])))
+        if column.hasNulls():
+            width = max(width, len("NULL"))
+        widths.append(width)
+    return widths
+
+def formatRow(row, widths):
+    return '| ' + ' | '.join(str(value).ljust(width) for value, width in izip(row, widths)) + ' |'
+
+def printTable(header, rows, widths=None):
+    # prints the result as an ASCII table while the rows are produced; without precomputed
+    # widths the rows are collected first to size the columns. Returns the number of rows
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
         print
-    return table
+        return 0
+    rows = chain([first], rows)
+    if widths is None:
+        rows = list(rows)
+        widths = [max(len(str(value)) for value in values) for values in izip(header, *rows)]
+    border = '+' + '+'.join('-' * (width + 2) for width in widths) + '+'
+    print border
+    print formatRow(header, widths)
+    print border
+    count = 0
+    for row in rows:
+        print formatRow(row, widths)
+        count += 1
+    print border
+    return count
+
+def normalizeQuery(query):
+    # cache key of a query plus the literals that were parameterized out of it, in query order
+    query = SPACED_PUNCTUATION_PATTERN.sub(r'\1', ' '.join(query.lower().split()).rstrip('; '))
+    return LITERAL_PATTERN.sub('?', query), LITERAL_PATTERN.findall(query)
+
+def mapComparisons(node, function):
+    # copy of an expression tree with function applied to its comparisons in query text order
+    if node is None:
+        return None
+    if isConnective(node):
+        return [node[0], [mapComparisons(child, function) for child in node[1]]]
+    return function(node)
 
-def solveCondition(conditions, index):
-    resultArr = []
-    if conditions[index][0][0] == conditions[index][1][0]:
-        # print "this"
-        temp = []
-        table = conditions[index][0][0]
-        firstCol  = conditions[index][0][1]
-        secondCol = conditions[index][1][1]
-        for l in range(len(databases[table.lower()][firstCol])):
-            if databases[table.lower()][firstCol][l] == databases[table.lower()][secondCol][l]:
-                temp.append(l)
-        resultArr.append([conditions[index][0][0], temp])
-
-    elif len(conditions[index][1]) == 1:
-        temp = []
-        table = conditions[index][0][0]
-        tempcol = conditions[index][0][1]
-        for l in range(len(databases[table.lower()][tempcol])):
-            if int(databases[table.lower()][tempcol][l]) == int(conditions[index][1][0]):
-                temp.append(l)
-        resultArr.append([conditions[index][0][0], temp])
+def parameterizeConditions(expressions, params):
+    # replaces every literal side of the conditions by its index into params; None when the
+    # literals do not line up with the ones found in the query text
+    index = 0
+    for expression in expressions:
+        for condition in iterComparisons(expression):
+            for side in condition[:2]:
+                if len(side) == 1:
+                    if index >= len(params) or side[0] != params[index]:
+                        return None
+                    index += 1
+    if index != len(params):
+        return None
+    counter = count()
+    return [mapComparisons(expression, lambda condition:
+                           [[next(counter)] if len(side) == 1 else side for side in condition[:2]] + [condition[2]])
+            for expression in expressions]
 
+def bindConditions(templates, params):
+    return [mapComparisons(template, lambda condition:
+                           [[params[side[0]]] if len(side) == 1 else side for side in condition[:2]] + [condition[2]])
+            for template in templates]
+
+def planQuery(query):
+    # parses the query and resolves its tables, columns, grouping, ordering and WHERE and HAVING
+    # expressions against the schema
+    tokens = parseQuery(query)
+    columns, tables, where = tokens.columns, tokens.tables, tokens.where
+    bValidTable, tableQueryList = checkTables(columns, tables)
+    if not bValidTable:
+        return None
+    bValidWhere, expression = checkConditions(where, tables)
+    if not bValidWhere:
+        return None
+    bValidGrouping, grouping = checkGrouping(list(tokens.groupBy or []), tables)
+    if not bValidGrouping:
+        return None
+    bValidHaving, having = checkConditions(tokens.having, tables, True)
+    if not bValidHaving:
+        return None
+    aggregated = bool(grouping) or having is not None or isAggregateQuery(tableQueryList)
+    bValidOrdering, ordering = checkOrdering([list(item) for item in tokens.orderBy or []], tables, aggregated)
+    if not bValidOrdering:
+        return None
+    # LIMIT count [OFFSET skipped]
+    limit = [int(value) for value in tokens.limit or []]
+    return [list(tables), tableQueryList, bool(tokens.distinct), grouping, ordering, limit, expression, having]
+
+def queryResult(query):
+    # plans a SELECT and sets up its pipeline: (header, rows, column widths or None), or None when
+    # the query is invalid. The rows are produced as they are iterated
+    key, params = normalizeQuery(query)
+    plan = queryCache.get(key)
+    if plan is None:
+        plan = planQuery(query)
+        if plan is None:
+            return None
+        # the LIMIT numbers are always the last literals of the query
+        expressions = plan[6:]
+        templates = parameterizeConditions(expressions, params[:len(params) - len(plan[5])])
+        if templates is not None:
+            queryCache.put(key, plan[:6] + templates)
     else:
-        temp1 = []
-        temp2 = []
-        firstTable  = conditions[index][0][0]
-        secondTable = conditions[index][1][0]
-        firstCol  = conditions[index][0][1]
-        secondCol = conditions[index][1][1]
-        for m in range(len(databases[firstTable.lower()][firstCol])):
-            for n in range(len(databases[secondTable.lower()][secondCol])):
-                if databases[firstTable.lower()][firstCol][m] == databases[secondTable.lower()][secondCol][n]:
-                    temp1.append(m)
-                    temp2.append(n)
-        resultArr.append([firstTable, temp1])
-        resultArr.append([secondTable, temp2])
-    return resultArr
-
-def solveWithConditions(querylist, conditions, conjunction):
-    rowList = []
-    firstCond = []
-    secondCond = []
-    for i in range(len(conditions)):
-        for j in range(len(conditions[i])):
-            if j == 0 and len(conditions[i][j]) == 1:
-                print colored("[ERROR]", 'red') + "Equate column to integer, not vice versa"
-                return []
-    firstCond = solveCondition(conditions, 0)
-    if len(conditions) == 2:
-        secondCond = solveCondition(conditions, 1)
-
-    if conjunction:
-        for statement in firstCond:
-            for secondStatement in secondCond:
-                if statement[0] == secondStatement[0]:
-                    firstSet = set(statement[1])
-                    secondSet = set(secondStatement[1])
-                    temp = {}
-                    if conjunction.lower() == 'and':
-                        temp = firstSet & secondSet
-                    else:
-                        temp = firstSet | secondSet
-                    templist = list(temp)
-                    templist.sort()
-                    rowList.append([statement[0], templist])
-
-    for statement in firstCond:
-        flag = 0
-        for row in rowList:
-            if statement[0] == row[0]:
-                flag = 1
-                break
-        if flag == 0:
-            rowList.append(statement)
-
-    for statement in secondCond:
-        flag = 0
-        for row in rowList:
-            if statement[0] == row[0]:
-                flag = 1
-                break
-        if flag == 0:
-            rowList.append(statement)
+        expressions = bindConditions(plan[6:], params)
+    tables, tableQueryList, distinct, grouping, ordering, limit = plan[:6]
+    limit = [int(value) for value in params[len(params) - len(limit):]] if limit else limit
+    conditions, having = expressions
+    databases.prefetch(tables, scanColumns(tableQueryList + grouping, conditions, having))
 
-    return rowList
+    scans, joinConditions, residual = pushDownConditions(conditions)
+    rowList = solveWithConditions(scans)
+    restrictDistinctColumns(tableQueryList, rowList)
+    # a LIMIT without ORDER BY only reads the first joined rows
+    limited = bool(limit) and not (ordering or distinct or grouping or having is not None or
+                                   isAggregateQuery(tableQueryList))
+    order, stream = joinTables(tables, rowList, joinConditions, residual, limited)
 
-def solveWithoutConditions(querylist, rowList = []):
-    # print "hello"
-    resultArr = []
-    for entry in querylist:
-        temparr = []
-        tableName = entry[0]
-        colName = entry[1]
-        if(len(entry) == 3):
-            if entry[2] == 'MAX' or entry[2] == 'max':
-                tempmax = -sys.maxint
-                index = -1
-                if rowList:
-                    tabflag = 0
-                    for row in rowList:
-                        if row[0] == tableName:
-                            tabflag = 1
-                            tempCols = row[1]
-                            for l in range(len(databases[tableName.lower()][colName])):
-                                if int(databases[tableName.lower()][colName][l]) > tempmax and l in tempCols:
-                                    tempmax = int(databases[tableName.lower()][colName][l])
-                            if tempmax != -sys.maxint:
-                                temparr.append([str(tempmax),0])
-                    if tabflag == 0:
-                        for l in databases[tableName.lower()][colName]:
-                            if int(l) > tempmax:
-                                tempmax = int(l)
-                        if tempmax != -sys.maxint:
-                            temparr.append([str(tempmax),0])
-                else:
-                    try:
-                        for l in databases[tableName.lower()][colName]:
-                            if int(l) > tempmax:
-                                tempmax = int(l)
-                    except:
-                        print colored("[ERROR]", 'red') + " Column %s contains non-integer values" % colName
-                        return
-                    if tempmax != -sys.maxint:
-                        temparr.append([str(tempmax), 0])
-
-            elif entry[2] == 'MIN' or entry[2] == 'min':
-                tempmin = sys.maxint
-                if rowList:
-                    tabflag = 0
-                    for row in rowList:
-                        if row[0] == tableName:
-                            tabflag = 1
-                            tempCols = row[1]
-                            for l in range(len(databases[tableName.lower()][colName])):
-                                if int(databases[tableName.lower()][colName][l]) < tempmin and l in tempCols:
-                                    tempmin = int(databases[tableName.lower()][colName][l])
-                            if tempmin != -sys.maxint:
-                                temparr.append([str(tempmin),0])
-                    if tabflag == 0:
-                        for l in databases[tableName.lower()][colName]:
-                            if int(l) < tempmin:
-                                tempmin = int(l)
-                        if tempmin != sys.maxint:
-                            temparr.append([str(tempmin),0])
-                else:
-                    try:
-                        for l in databases[tableName.lower()][colName]:
-                            if int(l) < tempmin:
-                                tempmin = int(l)
-                    except:
-                        print colored("[ERROR]", 'red') + " Column %s contains non-integer values" % colName
-                        return
-                    if tempmin != sys.maxint:
-                        temparr.append([str(tempmin), 0])
-
-            elif entry[2] == 'SUM' or entry[2] == 'sum':
-                tempmin = sys.maxint
-                sum = 0
-                if rowList:
-                    tabflag = 0
-                    for row in rowList:
-                        if row[0] == tableName:
-                            tabflag = 1
-                            tempCols = row[1]
-                            for l in range(len(databases[tableName.lower()][colName])):
-                                if l in tempCols:
-                                    sum += int(databases[tableName.lower()][colName][l])
-                            temparr.append([str(sum),0])
-                    if tabflag == 0:
-                        for l in databases[tableName.lower()][colName]:
-                            sum += int(l)
-                        temparr.append([str(sum),0])
-                else:
-                    for l in databases[tableName.lower()][colName]:
-                        sum += int(l)
-                    temparr.append([str(sum), 0])
-
-            elif entry[2] == 'AVG' or entry[2] == 'avg' or entry[2] == 'average':
-                sum = 0
-                count = 0
-                if rowList:
-                    tabflag = 0
-                    for row in rowList:
-                        sum1 = 0
-                        count1 = 0
-                        if row[0] == tableName:
-                            tabflag = 1
-                            tempCols = row[1]
-                            for l in range(len(databases[tableName.lower()][colName])):
-                                if l in tempCols:
-                                    sum1 += int(databases[tableName.lower()][colName][l])
-                                    count1 += 1
-                            avg = sum1/float(count1)
-                            temparr.append([str(avg1), 0])
-
-                    if tabflag == 0:
-                        for l in databases[tableName.lower()][colName]:
-                            sum += int(l)
-                            count += 1
-                        avg = sum/float(count)    
-                        temparr.append([str(avg),0])
-                else:
-                    for l in databases[tableName.lower()][colName]:
-                        sum += int(l)
-                    count = len(databases[tableName.lower()][colName])
-                    avg = sum / float(count)
-                    temparr.append([str(avg), 0])
-
-            elif entry[2] == 'DISTINCT' or entry[2] == 'distinct':
-                duplicate = []
-                newtemparr = [[x, databases[tableName.lower()][colName].index(x)]\
-                                for x in databases[tableName.lower()][colName] if x not in duplicate and (duplicate.append(x) or True)]
-                if rowList:
-                    tabflag = 0
-                    for row in rowList:
-                        if row[0] == tableName:
-                            tabflag = 1
-                            tempCols = row[1]
-                            for y in range(len(newtemparr)):
-                                if newtemparr[y][1] in tempCols:
-                                    temparr.append([newtemparr[y][0], newtemparr[y][1]])
-                    if tabflag == 0:
-                        temparr = newtemparr[:]
-                else:
-                    temparr = newtemparr[:]
-        else:
-            if rowList:
-                tabflag = 0
-                for row in rowList:
-                    if tableName == row[0]:
-                        tabflag = 1
-                        tempCols = row[1]
-                        for l in range(len(databases[tableName.lower()][colName])):
-                            if l in tempCols:
-                                temparr.append([databases[tableName.lower()][colName][l], l])
-                if tabflag == 0:
-                    for l in range(len(databases[tableName.lower()][colName])):
-                        temparr.append([databases[tableName.lower()][colName][l], l])
-                # pass
-            else:
-                for l in range(len(databases[tableName.lower()][colName])):
-                    temparr.append([databases[tableName.lower()][colName][l], l])
-        resultArr.append(temparr)
-    # print resultArr
-    return querylist, resultArr
+    if grouping or having is not None:
+        queryList, keys = orderEntries(tableQueryList, ordering)
+        rows = groupRows(queryList, order, stream, rowList, grouping, having)
+        header, widths = tableHeader(tableQueryList), None
+    elif isAggregateQuery(tableQueryList):
+        joined, weights = None, None
+        if joinConditions or residual:
+            rowList, joined, weights = participatingRows(order, stream)
+        elif len(order) > 1:
+            joined, weights = crossJoinWeights(order, rowList)
+        queryList, keys = tableQueryList, []
+        rows = [aggregateRow(tableQueryList, rowList, joined, weights)]
+        header, widths = tableHeader(tableQueryList), None
+    else:
+        selected = projectColumns(tableQueryList, joinConditions)
+        header = tableHeader(selected)
+        # a limited result is sized by its own rows rather than by scanning whole columns
+        widths = None if limit else columnWidths(selected, header)
+        if not distinct:
+            # ordered and limited by row ids, so only the rows shown are projected
+            key, reverse = comboSortKey(order, ordering) if ordering else (None, False)
+            return header, projectRows(selected, order, limitRows(stream, limit, key, reverse), bool(limit)), widths
+        queryList, keys = orderEntries(selected, ordering)
+        rows = projectRows(queryList, order, stream)
+
+    visible = len(header)
+    if distinct:
+        rows = [row for unused, row in hashDistinct((tuple(row[:visible]), row) for row in rows)]
+    rows = limitRows(rows, limit, sortKey(keys) if keys else None)
+    if len(queryList) > visible:
+        rows = (row[:visible] for row in rows)
+    return header, rows, widths
 
 def executeQuery(query):
+    # runs one statement; returns the number of result rows, or None when it failed
     try:
-        columns, tables, where = parseQuery(query)
-        bValidTable, tableQueryList = checkTables(columns, tables)
-        origQueryList = tableQueryList[:]
-        if not bValidTable:
+        if query.strip().lower().startswith('create '):
+            return 0 if createIndex(query) else None
+        result = queryResult(query)
+        if result is None:
             return
-        conditions, conjunction = checkConditions(where, tables)
-        # print tableQueryList, conditions, conjunction
-        if not conditions:
-            tableQueryList, result = solveWithoutConditions(tableQueryList)
-            # print result
-        else:
-            rowList = solveWithConditions(tableQueryList, conditions, conjunction)
-            tableQueryList, result = solveWithoutConditions(tableQueryList, rowList)
-        printTable(tableQueryList, result, origQueryList, conditions)
+        return printTable(*result)
     except:
         print colored("[ERROR]", 'red') + " Oops, error - please retry"
         return
@@ -725,12 +2929,466 @@ def queryEngine():
             return
         if not query:
             continue
+        if query == "cache":
+            print colored("[INFO]", 'green'), queryCache.stats()
+            print colored("[INFO]", 'green'), databases.stats()
+            continue
         executeQuery(query)
         # print query
 
+def splitStatements(text):
+    # the non-empty ;-separated statements of a batch script
+    statements = []
+    start = 0
+    for match in STATEMENT_PATTERN.finditer(text):
+        if match.group() == ';':
+            statements.append(text[start:match.start()])
+            start = match.end()
+    statements.append(text[start:])
+    return [statement.strip() for statement in statements if COMMENT_PATTERN.sub('', statement).strip()]
+
+def runBatch(text, summaryPath=None):
+    # runs a script of statements against the loaded databases, sharing the plan and table caches
+    # between them. Every result is followed by its timing, and a JSON summary is printed (or
+    # written to summaryPath) at the end. Returns whether every statement succeeded
+    results = []
+    batchStart = time.time()
+    for number, statement in enumerate(splitStatements(text), 1):
+        print colored("SqlEngine> ", 'white') + statement
+        start = time.time()
+        rows = executeQuery(statement)
+        elapsed = (time.time() - start) * 1000
+        if rows is None:
+            print colored("[INFO]", 'green'), "Query %d failed after %.1f ms" % (number, elapsed)
+        else:
+            print colored("[INFO]", 'green'), "Query %d: %d row(s) in %.1f ms" % (number, rows, elapsed)
+        results.append(OrderedDict([('query', number), ('statement', statement),
+                                    ('status', 'error' if rows is None else 'ok'), ('rows', rows),
+                                    ('ms', round(elapsed, 3))]))
+
+    failed = sum(1 for result in results if result['status'] == 'error')
+    summary = OrderedDict([
+        ('queries', len(results)),
+        ('succeeded', len(results) - failed),
+        ('failed', failed),
+        ('total_ms', round((time.time() - batchStart) * 1000, 3)),
+        ('plan_cache', OrderedDict([('hits', queryCache.hits), ('misses', queryCache.misses)])),
+        ('table_loads', databases.loads),
+        ('results', results),
+    ])
+    if summaryPath is None:
+        print json.dumps(summary)
+    else:
+        with open(summaryPath, 'w') as summaryFile:
+            json.dump(summary, summaryFile, indent=2)
+        print colored("[INFO]", 'green'), "Summary written to %s" % summaryPath
+    return not failed
+
+def captureQuery(query):
+    # runs a query with its printed output captured: (output, rows or None, milliseconds)
+    output = StringIO()
+    stdout = sys.stdout
+    sys.stdout = output
+    start = time.time()
+    try:
+        rows = executeQuery(query)
+    finally:
+        sys.stdout = stdout
+    return output.getvalue(), rows, (time.time() - start) * 1000
+
+def ignoreInterrupts():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def interruptServer(signum, frame):
+    raise KeyboardInterrupt
+
+class QueryServer(object):
+    # runs the queries of all connections against the loaded databases, which it never changes.
+    # Queries go to a pool of worker processes forked after the tables were preloaded, so the
+    # column buffers are shared by all of them (copy-on-write pages that are never written);
+    # without workers they run one at a time in the server process
+    def __init__(self, workers, maxConnections, queueDepth):
+        databases.preload()
+        self.pool = multiprocessing.Pool(workers, ignoreInterrupts) if workers else None
+        self.lock = threading.Lock()
+        self.connections = threading.BoundedSemaphore(maxConnections)
+        self.queueDepth = queueDepth
+
+    def run(self, query):
+        if query.lower().startswith('create '):
+            return colored("[ERROR]", 'red') + " The server does not change the database\n", None, 0.0
+        if self.pool is None:
+            with self.lock:
+                return captureQuery(query)
+        return self.pool.apply(captureQuery, (query,))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+
+class QueryHandler(SocketServer.StreamRequestHandler):
+    # line protocol: every line a client sends is a query ("quit" ends the session). The reply
+    # to each query is its printed output followed by a status line, "-- ok <rows> <ms>" or
+    # "-- error <ms>"; replies come in the order the queries were sent. A connection's queries
+    # wait in a queue of SERVER_QUEUE_DEPTH, beyond which reading from the client pauses
+    def handle(self):
+        server = self.server.queryServer
+        if not server.connections.acquire(False):
+            self.wfile.write("-- error too many connections\n")
+            return
+        try:
+            queries = Queue.Queue(server.queueDepth)
+            responder = threading.Thread(target=self.respond, args=(server, queries))
+            responder.daemon = True
+            responder.start()
+            for line in iter(self.rfile.readline, ''):
+                query = line.strip().rstrip(';').strip()
+                if query in ('quit', 'q'):
+                    break
+                if query:
+                    queries.put(query)
+            queries.put(None)
+            responder.join()
+        finally:
+            server.connections.release()
+
+    def respond(self, server, queries):
+        connected = True
+        for query in iter(queries.get, None):
+            if not connected:
+                continue
+            output, rows, elapsed = server.run(query)
+            if rows is None:
+                status = "-- error %.1f\n" % elapsed
+            else:
+                status = "-- ok %d %.1f\n" % (rows, elapsed)
+            try:
+                self.wfile.write(output + status)
+                self.wfile.flush()
+            except socket.error:
+                # the client went away; its remaining queries are dropped
+                connected = False
+
+class ThreadingTCPQueryServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class ThreadingUnixQueryServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+def serverAddress(address):
+    # (socket family, address) of host:port, or of a Unix socket when address is a path
+    if address.find('/') != -1:
+        if os.path.exists(address):
+            os.remove(address)
+        return socket.AF_UNIX, address
+    host, port = address.rsplit(':', 1) if address.find(':') != -1 else ('localhost', address)
+    return socket.AF_INET, (host, int(port))
+
+def serve(address, workers, maxConnections, queueDepth):
+    # serves queries on host:port, or on a Unix socket when address is a path
+    queryServer = QueryServer(workers, maxConnections, queueDepth)
+    family, bindAddress = serverAddress(address)
+    if family == socket.AF_UNIX:
+        server = ThreadingUnixQueryServer(bindAddress, QueryHandler)
+    else:
+        server = ThreadingTCPQueryServer(bindAddress, QueryHandler)
+    server.queryServer = queryServer
+    print >> sys.stderr, colored("[INFO]", 'green'), "Serving on %s with %s" % \
+        (address, "%d worker processes" % workers if workers else "no worker processes")
+    # SIGTERM shuts down like Ctrl-C, so the pool and the socket file are cleaned up
+    signal.signal(signal.SIGTERM, interruptServer)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queryServer.close()
+        if address.find('/') != -1 and os.path.exists(address):
+            os.remove(address)
+
+def formatValue(value):
+    return "NULL" if value is None else str(value)
+
+def streamQuery(query, output):
+    # runs a query in a child process of the streaming server, writing its result to output as it
+    # is produced: a "-- columns" line, the rows as comma separated lines in chunks of
+    # STREAM_CHUNK_ROWS, a "-- message" line for everything the query printed, and the status line
+    messages = StringIO()
+    sys.stdout = messages
+    start = time.time()
+    rows = None
+    try:
+        result = queryResult(query)
+        if result is not None:
+            header, resultRows, widths = result
+            output.write("-- columns %s\n" % ','.join(header))
+            output.flush()
+            rows = 0
+            for chunk in iterRuns(resultRows, STREAM_CHUNK_ROWS):
+                output.write(''.join(','.join(imap(formatValue, row)) + '\n' for row in chunk))
+                output.flush()
+                rows += len(chunk)
+    except:
+        rows = None
+        print colored("[ERROR]", 'red') + " Oops, error - please retry"
+    for line in messages.getvalue().splitlines():
+        output.write("-- message %s\n" % line)
+    elapsed = (time.time() - start) * 1000
+    if rows is None:
+        output.write("-- error %.1f\n" % elapsed)
+    else:
+        output.write("-- ok %d %.1f\n" % (rows, elapsed))
+    output.flush()
+
+class StreamQuery(asyncore.file_dispatcher):
+    # one running query of a StreamConnection. It runs in a child process forked from the server,
+    # which shares the preloaded tables, and its result is read from a pipe and passed on to the
+    # client in whole lines. Reading pauses while the client has STREAM_BUFFER_BYTES waiting, which
+    # blocks the child. Cancelling kills the child
+    def __init__(self, connection, query):
+        reader, writer = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(reader)
+                # the child only writes to its pipe; keeping the listener, the client sockets and the
+                # other queries' pipes open would hold back the EOF of clients the server closes
+                for fd in list(asyncore.socket_map):
+                    os.close(fd)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                ignoreInterrupts()
+                # the server already runs queries side by side; a pool per query would outlive it
+                scanPool.workers = 1
+                streamQuery(query, os.fdopen(writer, 'wb'))
+            finally:
+                os._exit(0)
+        os.close(writer)
+        asyncore.file_dispatcher.__init__(self, reader)
+        os.close(reader)
+        self.pid = pid
+        self.connection = connection
+        self.start = time.time()
+        self.partial = ''
+        self.done = False
+
+    def readable(self):
+        return self.connection.pending() < STREAM_BUFFER_BYTES
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        data = self.partial + self.recv(65536)
+        end = data.rfind('\n') + 1
+        if end:
+            self.connection.push(data[:end])
+        self.partial = data[end:]
+
+    def handle_close(self):
+        self.finish()
+
+    def cancel(self):
+        # stops the query; the rows already sent stay sent and are followed by "-- cancelled <ms>"
+        if not self.done:
+            os.kill(self.pid, signal.SIGKILL)
+            self.finish("-- cancelled %.1f\n" % ((time.time() - self.start) * 1000))
+
+    def finish(self, status=None):
+        if self.done:
+            return
+        self.done = True
+        self.close()
+        os.waitpid(self.pid, 0)
+        self.connection.finished(status)
+
+class StreamConnection(asynchat.async_chat):
+    # line protocol of the streaming server: every line is a query, "cancel" stops the query that
+    # is running and "quit" ends the session once the queued queries are answered. Replies come in
+    # the order the queries were sent; each is a "-- columns" line, the rows as they are produced,
+    # any "-- message" lines and a status line: "-- ok <rows> <ms>", "-- error <ms>" or
+    # "-- cancelled <ms>". While queueDepth queries are waiting nothing more is read from the client
+    ac_out_buffer_size = 65536
+
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock)
+        self.set_terminator('\n')
+        self.server = server
+        self.buffer = []
+        self.queries = deque()
+        self.running = None
+        self.waiting = False
+        self.quitting = False
+        self.closed = False
+
+    def collect_incoming_data(self, data):
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        line = ''.join(self.buffer).strip().rstrip(';').strip()
+        self.buffer = []
+        if line in ('quit', 'q'):
+            self.quitting = True
+        elif line == 'cancel':
+            if self.running is not None:
+                self.running.cancel()
+        elif line:
+            self.queries.append(line)
+        self.next()
+
+    def readable(self):
+        return not self.quitting and len(self.queries) < self.server.queueDepth
+
+    def pending(self):
+        return sum(len(data) for data in self.producer_fifo if data)
+
+    def next(self):
+        # waits for a free worker slot when the next query can start
+        if self.running is not None or self.waiting or self.closed:
+            return
+        if self.queries:
+            self.waiting = True
+            self.server.waiting.append(self)
+            self.server.schedule()
+        elif self.quitting:
+            self.close_when_done()
+
+    def start(self):
+        self.waiting = False
+        query = self.queries.popleft()
+        if query.lower().startswith('create '):
+            self.push("-- message " + colored("[ERROR]", 'red') + " The server does not change the database\n")
+            self.push("-- error 0.0\n")
+            self.next()
+            return False
+        self.running = StreamQuery(self, query)
+        return True
+
+    def finished(self, status):
+        self.running = None
+        if status is not None and not self.closed:
+            self.push(status)
+        self.server.running -= 1
+        self.server.schedule()
+        self.next()
+
+    def handle_close(self):
+        self.closed = True
+        self.close()
+        self.server.connections.discard(self)
+        if self.running is not None:
+            self.running.cancel()
+
+class StreamServer(asyncore.dispatcher):
+    # accepts the clients of the streaming server and runs at most `workers` queries at a time,
+    # handing free slots to waiting connections in turn
+    def __init__(self, family, address, workers, maxConnections, queueDepth):
+        asyncore.dispatcher.__init__(self)
+        self.create_socket(family, socket.SOCK_STREAM)
+        if family != socket.AF_UNIX:
+            self.set_reuse_addr()
+        self.bind(address)
+        self.listen(maxConnections)
+        self.workers = max(workers, 1)
+        self.maxConnections = maxConnections
+        self.queueDepth = queueDepth
+        self.connections = set()
+        self.waiting = deque()
+        self.running = 0
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        sock = pair[0]
+        if len(self.connections) >= self.maxConnections:
+            sock.sendall("-- error too many connections\n")
+            sock.close()
+            return
+        self.connections.add(StreamConnection(sock, self))
+
+    def schedule(self):
+        while self.running < self.workers and self.waiting:
+            connection = self.waiting.popleft()
+            if not connection.closed and connection.start():
+                self.running += 1
+
+    def close(self):
+        for connection in list(self.connections):
+            connection.handle_close()
+        asyncore.dispatcher.close(self)
+
+def serveStreaming(address, workers, maxConnections, queueDepth):
+    # streaming server on host:port or a Unix socket: one event loop serves every client, and each
+    # query runs in its own child process forked after the tables were preloaded
+    databases.preload()
+    family, bindAddress = serverAddress(address)
+    server = StreamServer(family, bindAddress, workers, maxConnections, queueDepth)
+    print >> sys.stderr, colored("[INFO]", 'green'), "Streaming results on %s, %d queries at a time" % \
+        (address, server.workers)
+    signal.signal(signal.SIGTERM, interruptServer)
+    try:
+        asyncore.loop(use_poll=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+
+def popOption(name):
+    # removes "name value" from the command line and returns the value (None when absent)
+    if name not in sys.argv:
+        return None
+    position = sys.argv.index(name)
+    if position + 1 >= len(sys.argv):
+        print colored("[ERROR]", 'red'), "Missing value for %s" % name
+        sys.exit(2)
+    value = sys.argv[position + 1]
+    del sys.argv[position:position + 2]
+    return value
+
 def main():
-    loadParser()
+    loadParser('--pyparsing' in sys.argv)
+    if '--pyparsing' in sys.argv:
+        sys.argv.remove('--pyparsing')
+    streaming = '--stream' in sys.argv
+    if streaming:
+        sys.argv.remove('--stream')
+    batch = popOption('--batch')
+    summaryPath = popOption('--summary')
+    databasePath = popOption('--path')
+    address = popOption('--serve')
+    workers = popOption('--workers')
+    maxConnections = popOption('--max-connections')
+    queueDepth = popOption('--queue-depth')
+    parallel = popOption('--parallel')
+    if parallel is not None:
+        scanPool.workers = int(parallel)
     global databases
+    if batch is not None or address is not None:
+        path = databasePath or os.path.dirname(os.path.abspath(__file__))
+        if not os.path.isdir(path):
+            # no prompting for another path: the script may be coming in on stdin
+            print colored("[ERROR]",'red'),"Invalid path: Path does not exist... ", path
+            sys.exit(1)
+        path, files = getFiles(path)
+        databases = loadDatabases(path, files)
+        if databases == "error":
+            print colored("[ERROR]", 'red'), "Error loading databases, please fix and retry"
+            sys.exit(1)
+        if address is not None:
+            (serveStreaming if streaming else serve)(address, SERVER_WORKERS if workers is None else int(workers),
+                                                     int(maxConnections or SERVER_MAX_CONNECTIONS),
+                                                     int(queueDepth or SERVER_QUEUE_DEPTH))
+            return
+        if batch == '-':
+            text = sys.stdin.read()
+        else:
+            with open(batch) as script:
+                text = script.read()
+        sys.exit(0 if runBatch(text, summaryPath) else 1)
     if len(sys.argv) > 1:
         cur_path = os.path.dirname(os.path.abspath(__file__))
         path, files = getFiles(cur_path)